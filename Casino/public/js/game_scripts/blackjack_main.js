@@ -313,6 +313,33 @@ function configureSocketClientCallbacks() {
         }, 3000);
     };
 
+    socketClient.onOpponentDisconnected = (payload) => {
+        uiManager.setTurnIndicator(`${payload.opponentName || 'Tu oponente'} perdió la conexión. Esperando ${payload.graceSeconds}s a que vuelva...`);
+    };
+
+    socketClient.onOpponentReconnected = (payload) => {
+        uiManager.setTurnIndicator(`${payload.opponentName || 'Tu oponente'} volvió a la mesa.`);
+    };
+
+    socketClient.onReconnecting = (info) => {
+        uiManager.setTurnIndicator(`Conexión perdida. Reconectando (intento ${info.attempt})...`, true);
+    };
+
+    socketClient.onResumed = (payload) => {
+        uiManager.setTurnIndicator(`Reconectado a la mesa ${payload.gameId} como ${payload.playerId}.`);
+    };
+
+    socketClient.onResumeFailed = (payload) => {
+        // La mesa ya se cerró: buscar otra conservando el saldo
+        uiManager.setTurnIndicator("La partida anterior ya no existe. Buscando otra mesa...", true);
+        socketClient.joinGameRequest();
+    };
+
+    socketClient.onHint = (payload) => {
+        const best = payload.best === "HIT" ? "Pedir" : "Plantarse";
+        uiManager.setTurnIndicator(`Pista: ${best} (pedir ${payload.hit.toFixed(2)}, plantarse ${payload.stand.toFixed(2)} por ficha apostada).`);
+    };
+
     socketClient.onServerError = (payload) => {
         uiManager.setTurnIndicator(`Error del servidor: ${payload.message}`, true);
     };
@@ -2,13 +2,51 @@
 
 const SERVER_URL = "ws://192.168.1.18:8765"; // Cambia 'localhost' por la IP del servidor si es diferente
 
+// Aplica una lista de operaciones JSON Patch (RFC 6902: add/replace/remove) a una copia del estado
+export function applyStatePatch(state, ops) {
+    const newState = structuredClone(state);
+    for (const op of ops) {
+        if (op.path === "") return structuredClone(op.value);
+        const parts = op.path.split("/").slice(1);
+        const last = parts.pop();
+        let target = newState;
+        for (const part of parts) target = target[Array.isArray(target) ? Number(part) : part];
+        if (Array.isArray(target)) {
+            const index = Number(last);
+            if (op.op === "add") target.splice(index, 0, op.value);
+            else if (op.op === "remove") target.splice(index, 1);
+            else target[index] = op.value;
+        } else if (op.op === "remove") {
+            delete target[last];
+        } else {
+            target[last] = op.value;
+        }
+    }
+    return newState;
+}
+
 export class SocketClient {
     constructor() {
         this.socket = null;
+        this.serverUrl = SERVER_URL; // Puede cambiar a otro puerto si el servidor manda REDIRECT (modo --workers)
+        this.redirectJoin = null; // JOIN_GAME_REQUEST a enviar al abrir la conexión redirigida
         this.serverPlayerId = null;
         this.gameId = null;
         this.playerIdInGame = null;
 
+        this.resumeToken = null; // Secreto del asiento (GAME_CREATED/JOINED_GAME), para RESUME_SESSION y para recuperar el saldo. No compartirlo
+        this.resumeUrl = null; // Con --workers hay que volver al mismo worker (resumePort)
+        this.autoResume = true; // Si la conexión se cae en medio de una partida, reconectar y pedir el mismo asiento
+        this.maxResumeAttempts = 5; // 0.5s, 1s, 2s, 4s, 8s: dentro de la gracia por defecto del servidor (30s)
+        this.resumeAttempts = 0;
+        this.resumePending = false; // Reconectando: al llegar SERVER_WELCOME se envía RESUME_SESSION
+        this.closingByUser = false; // closeConnection() no reintenta
+
+        this.useDeltaState = true; // Pedir GAME_STATE_DELTA si el servidor lo anuncia en SERVER_WELCOME
+        this.lastState = null; // Último estado completo reconstruido (base para aplicar deltas)
+        this.stateSeq = null; // seq del último estado aplicado
+        this.resyncPending = false; // Ya se pidió un snapshot completo, ignorar deltas hasta recibirlo
+
         this.onOpen = null; // Callback a ser definido por blackjack_main.js
         this.onClose = null;
         this.onError = null;
@@ -21,6 +59,13 @@ export class SocketClient {
         this.onServerError = null;
         this.onActionReceived = null;
         this.onNewRound = null;
+        this.onTableList = null;
+        this.onReconnecting = null;
+        this.onResumed = null;
+        this.onResumeFailed = null;
+        this.onOpponentDisconnected = null;
+        this.onOpponentReconnected = null;
+        this.onHint = null; // respuesta a requestHint: EV de pedir y de plantarse
     }
 
     connect() {
@@ -38,11 +83,19 @@ export class SocketClient {
             }
 
 
-            this.socket = new WebSocket(SERVER_URL);
+            this.socket = new WebSocket(this.serverUrl);
 
             this.socket.onopen = (event) => {
-                console.log("SocketClient: Conectado al servidor WebSocket:", SERVER_URL);
-                if (this.onOpen) this.onOpen(event); // Llamar al callback onOpen
+                console.log("SocketClient: Conectado al servidor WebSocket:", this.serverUrl);
+                if (this.resumePending) {
+                    // Reconexión: RESUME_SESSION se envía al recibir SERVER_WELCOME
+                } else if (this.redirectJoin) { // Reconexión por REDIRECT: unirse directamente a la mesa indicada
+                    const join = this.redirectJoin;
+                    this.redirectJoin = null;
+                    this.joinGameRequest(join);
+                } else if (this.onOpen) {
+                    this.onOpen(event); // Llamar al callback onOpen
+                }
                 resolve();
             };
 
@@ -58,10 +111,19 @@ export class SocketClient {
 
             this.socket.onclose = (event) => {
                 console.log("SocketClient: Desconectado del servidor WebSocket.", event.reason, `(Code: ${event.code})`);
+                const inGame = this.gameId !== null && this.resumeToken !== null;
+                this.socket = null;
+                this.resetStateSync();
+                if (this.autoResume && !this.closingByUser && (inGame || this.resumePending) && this.resumeAttempts < this.maxResumeAttempts) {
+                    this.scheduleResume(); // El servidor guarda el asiento unos segundos
+                    return;
+                }
+                this.closingByUser = false;
+                this.resumePending = false;
+                this.resumeAttempts = 0;
                 this.gameId = null; // Resetear gameId al desconectar
                 this.playerIdInGame = null; // Resetear playerIdInGame
                 if (this.onClose) this.onClose(event);
-                this.socket = null;
             };
         });
     }
@@ -74,30 +136,68 @@ export class SocketClient {
             switch (message.type) {
                 case "SERVER_WELCOME":
                     this.serverPlayerId = message.payload.serverPlayerId;
+                    if (this.useDeltaState && (message.payload.protocols || []).includes("delta")) {
+                        this.sendMessage("SET_PROTOCOL", { mode: "delta" });
+                    }
+                    if (this.resumePending) this.sendMessage("RESUME_SESSION", { resumeToken: this.resumeToken });
                     if (this.onWelcome) this.onWelcome(message.payload);
                     break;
                 case "GAME_CREATED":
-                    this.gameId = message.payload.gameId;
-                    this.playerIdInGame = message.payload.playerId;
+                    this.rememberSeat(message.payload);
                     if (this.onGameCreated) this.onGameCreated(message.payload);
                     break;
                 case "JOINED_GAME":
-                    this.gameId = message.payload.gameId;
-                    this.playerIdInGame = message.payload.playerId;
+                    this.rememberSeat(message.payload);
                     if (this.onJoinedGame) this.onJoinedGame(message.payload);
                     break;
+                case "RESUMED":
+                    this.rememberSeat(message.payload);
+                    this.resumePending = false;
+                    this.resumeAttempts = 0;
+                    this.resetStateSync(); // El servidor manda a continuación el estado completo
+                    if (this.onResumed) this.onResumed(message.payload);
+                    break;
+                case "RESUME_FAILED":
+                    if (message.payload.resumePort) { // El asiento está en otro worker (--workers): reanudar allí
+                        this.reconnectTo(message.payload.resumePort);
+                        this.resumeUrl = this.serverUrl; // resumePending sigue activo: RESUME_SESSION al llegar SERVER_WELCOME
+                        break;
+                    }
+                    // El asiento ya no existe; resumeToken se conserva para recuperar el saldo en el próximo JOIN_GAME_REQUEST
+                    this.resumePending = false;
+                    this.resumeAttempts = 0;
+                    this.gameId = null;
+                    this.playerIdInGame = null;
+                    if (this.onResumeFailed) this.onResumeFailed(message.payload);
+                    break;
+                case "OPPONENT_DISCONNECTED":
+                    if (this.onOpponentDisconnected) this.onOpponentDisconnected(message.payload);
+                    break;
+                case "OPPONENT_RECONNECTED":
+                    if (this.onOpponentReconnected) this.onOpponentReconnected(message.payload);
+                    break;
                 case "OPPONENT_JOINED":
                     if (this.onOpponentJoined) this.onOpponentJoined(message.payload);
                     break;
                 case "GAME_STATE_UPDATE":
                     // Actualizar gameId por si acaso (aunque debería ser consistente)
                     if (message.payload.gameId) this.gameId = message.payload.gameId;
+                    this.lastState = message.payload;
+                    this.stateSeq = (typeof message.seq === 'number') ? message.seq : null;
+                    this.resyncPending = false;
                     if (this.onGameStateUpdate) this.onGameStateUpdate(message.payload);
                     break;
+                case "GAME_STATE_DELTA":
+                    this.handleStateDelta(message.payload);
+                    break;
+                case "PROTOCOL_SET":
+                    console.log("SocketClient: Protocolo de estado:", message.payload.mode);
+                    break;
                 case "OPPONENT_LEFT":
                     if (this.onOpponentLeft) this.onOpponentLeft(message.payload);
                     this.gameId = null; // Resetear gameId
                     this.playerIdInGame = null;
+                    this.resetStateSync();
                     break;
                 case "ERROR":
                     if (this.onServerError) this.onServerError(message.payload);
@@ -106,6 +206,15 @@ export class SocketClient {
                 case "ACTION_RECEIVED":
                     if (this.onActionReceived) this.onActionReceived(message.payload);
                     break;
+                case "REDIRECT":
+                    this.followRedirect(message.payload);
+                    break;
+                case "TABLE_LIST":
+                    if (this.onTableList) this.onTableList(message.payload);
+                    break;
+                case "HINT":
+                    if (this.onHint) this.onHint(message.payload);
+                    break;
                 case "NEW_ROUND":
                      if(this.onNewRound) this.onNewRound(message.payload);
                      break;
@@ -117,6 +226,72 @@ export class SocketClient {
         }
     }
 
+    rememberSeat(payload) {
+        this.gameId = payload.gameId;
+        this.playerIdInGame = payload.playerId;
+        this.resumeToken = payload.resumeToken;
+        if (payload.resumePort) {
+            const url = new URL(this.serverUrl);
+            url.port = String(payload.resumePort);
+            this.resumeUrl = url.toString();
+        }
+    }
+
+    // Reconexión con espera creciente; al conectar se pide el mismo asiento con RESUME_SESSION
+    scheduleResume() {
+        const delay = Math.min(500 * 2 ** this.resumeAttempts, 8000);
+        this.resumeAttempts++;
+        this.resumePending = true;
+        if (this.resumeUrl) this.serverUrl = this.resumeUrl;
+        console.warn(`SocketClient: Conexión perdida. Reintento ${this.resumeAttempts} en ${delay}ms.`);
+        if (this.onReconnecting) this.onReconnecting({ attempt: this.resumeAttempts, delay: delay });
+        setTimeout(() => {
+            this.connect().catch((error) => console.error("SocketClient: Falló la reconexión:", error)); // onclose vuelve a intentarlo
+        }, delay);
+    }
+
+    // La mesa (o el saldo del resumeToken) está en otro proceso del servidor: reconectar a su puerto y pedir esa mesa
+    followRedirect(payload) {
+        console.log("SocketClient: Redirigido al puerto", payload.port, "para la mesa", payload.gameId);
+        // fallback: si la mesa ya se llenó al llegar, el servidor empareja en otra del mismo nivel y tamaño
+        this.redirectJoin = { gameId: payload.gameId, stake: payload.stake, seats: payload.seats, fallback: true };
+        this.reconnectTo(payload.port);
+    }
+
+    // Cierra la conexión actual sin avisar a la aplicación y abre otra al mismo host en otro puerto
+    reconnectTo(port) {
+        const url = new URL(this.serverUrl);
+        url.port = String(port);
+        const oldSocket = this.socket;
+        oldSocket.onclose = null; // No es una desconexión para la aplicación
+        oldSocket.close();
+        this.socket = null;
+        this.serverUrl = url.toString();
+        this.connect().catch((error) => console.error("SocketClient: Falló la reconexión:", error));
+    }
+
+    // Aplica un delta si continúa la secuencia; si hay un hueco pide un snapshot completo (RESYNC_REQUEST)
+    handleStateDelta(payload) {
+        if (this.stateSeq !== null && payload.seq <= this.stateSeq) return; // Delta viejo o repetido
+        if (!this.lastState || this.stateSeq === null || payload.seq !== this.stateSeq + 1) {
+            if (!this.resyncPending) {
+                console.warn(`SocketClient: Hueco en seq (tengo ${this.stateSeq}, llegó ${payload.seq}). Pidiendo resync.`);
+                this.resyncPending = true;
+                this.sendMessage("RESYNC_REQUEST");
+            }
+            return;
+        }
+        this.lastState = applyStatePatch(this.lastState, payload.ops);
+        this.stateSeq = payload.seq;
+        if (this.onGameStateUpdate) this.onGameStateUpdate(this.lastState);
+    }
+
+    resetStateSync() {
+        this.lastState = null;
+        this.stateSeq = null;
+        this.resyncPending = false;
+    }
+
     sendMessage(type, payload = {}) {
         if (!this.socket || this.socket.readyState !== WebSocket.OPEN) {
             console.error("SocketClient: No conectado. No se puede enviar mensaje.");
@@ -139,9 +314,16 @@ export class SocketClient {
         }
     }
 
-    joinGameRequest() {
-        // No añadir gameId aquí, el servidor lo gestiona para JOIN_GAME_REQUEST
-        this.sendMessage("JOIN_GAME_REQUEST", {});
+    // options: { stake: "low"|"standard"|"high", seats: 1-5 } para emparejar, o { gameId } para una mesa de TABLE_LIST
+    joinGameRequest(options = {}) {
+        // No añadir this.gameId aquí, el servidor lo gestiona para JOIN_GAME_REQUEST
+        // Con el resumeToken de un asiento anterior el servidor recupera ese saldo (si usa --ledger)
+        const returning = this.resumeToken ? { resumeToken: this.resumeToken } : {};
+        this.sendMessage("JOIN_GAME_REQUEST", { ...returning, ...options });
+    }
+
+    listTables(filters = {}) {
+        this.sendMessage("LIST_TABLES", { ...filters });
     }
 
     placeBet(amount) {
@@ -161,12 +343,20 @@ export class SocketClient {
         this.sendMessage("PLAYER_ACTION", { action: action });
     }
 
+    // Pista para la mano actual (solo en el turno propio): "table" usa un zapato recién barajado,
+    // "shoe" tiene en cuenta las cartas que ya salieron del zapato
+    requestHint(mode = "table") {
+        this.sendMessage("HINT_REQUEST", { mode: mode });
+    }
+
     requestNewRound() {
         this.sendMessage("START_NEW_ROUND_REQUEST");
     }
 
     closeConnection() {
+        this.resumePending = false;
         if (this.socket) {
+            this.closingByUser = true;
             this.socket.close();
             // this.socket = null; // Se pondrá a null en el evento onclose
         }
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# bench.py: prueba de carga del servidor de Blackjack con clientes sinteticos que hablan el protocolo real
+# Lanza server.py en un puerto local, conecta miles de clientes asyncio que se sientan en mesas, apuestan,
+# piden/plantan y empiezan rondas nuevas, y mide conexiones/s, rondas/s, latencia por tipo de mensaje y RSS del servidor.
+# Ejemplo: python bench.py --clients 2000 --rounds 5 --out resultados.json --compare base.json
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import websockets
+
+SERVER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py")
+
+def percentile(sorted_values, q):
+    if not sorted_values: return None
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+def apply_patch(state, ops):# aplica GAME_STATE_DELTA (JSON Patch) sobre el estado, como SocketClient.js
+    for op in ops:
+        parts = op["path"].split("/")[1:]; target = state
+        for part in parts[:-1]: target = target[int(part)] if isinstance(target, list) else target[part]
+        key = int(parts[-1]) if isinstance(target, list) else parts[-1]
+        if op["op"] == "remove": del target[key]
+        elif op["op"] == "add" and isinstance(target, list): target.insert(key, op["value"])
+        else: target[key] = op["value"]
+    return state
+
+class Stats:# latencias por tipo de mensaje y contadores de toda la corrida
+    def __init__(self): self.latencies = {}; self.rounds = 0; self.errors = 0; self.failed_clients = 0; self.messages_in = 0
+    def record(self, msg_type, seconds): self.latencies.setdefault(msg_type, []).append(seconds)
+    def latency_report(self):
+        report = {}
+        for msg_type, values in sorted(self.latencies.items()):
+            values.sort()
+            report[msg_type] = {"count": len(values), "mean_ms": 1000 * sum(values) / len(values),
+                                **{f"p{name}_ms": 1000 * percentile(values, q) for name, q in (("50", 0.50), ("99", 0.99), ("999", 0.999))}}
+        return report
+
+class BotClient:# jugador sintetico: apuesta fijo, pide carta con menos de 17 y el jugador 1 de la mesa pide la ronda siguiente
+    def __init__(self, uri, stats, rounds, seats, bet, delta, timeout):
+        self.uri = uri; self.stats = stats; self.rounds = rounds; self.seats = seats; self.bet = bet; self.delta = delta; self.timeout = timeout
+        self.ws = None; self.me = None; self.state = None; self.rounds_done = 0; self.last_phase = None
+        self.pending = None # (tipo, t0, condicion) del mensaje en vuelo; la condicion (sobre el mensaje y el estado ya aplicado) dice que respuesta lo resuelve
+    async def send(self, msg_type, payload, resolved_by):
+        self.pending = (msg_type, time.perf_counter(), resolved_by)
+        await self.ws.send(json.dumps({"type": msg_type, "payload": payload}))
+    def resolve(self, message):
+        if not self.pending: return
+        msg_type, sent_at, resolved_by = self.pending
+        if message["type"] == "ERROR" or resolved_by(message):
+            self.stats.record(msg_type, time.perf_counter() - sent_at); self.pending = None
+    def state_is(self, message, condition): return message["type"].startswith("GAME_STATE") and self.state is not None and condition()
+    def my_seat(self): return self.state.get(self.me) or {}
+    async def connect(self, uri=None):
+        self.ws = await websockets.connect(uri or self.uri, max_queue=None)
+        await self.ws.recv() # SERVER_WELCOME
+        if self.delta: await self.ws.send(json.dumps({"type": "SET_PROTOCOL", "payload": {"mode": "delta"}}))
+    async def play(self):
+        await self.send("JOIN_GAME_REQUEST", {"seats": self.seats}, lambda m: m["type"] in ("GAME_CREATED", "JOINED_GAME", "REDIRECT"))
+        while self.rounds_done < self.rounds:
+            message = json.loads(await asyncio.wait_for(self.ws.recv(), self.timeout)); self.stats.messages_in += 1
+            msg_type = message["type"]
+            if msg_type == "GAME_STATE_UPDATE": self.state = message["payload"]
+            elif msg_type == "GAME_STATE_DELTA" and self.state is not None: self.state = apply_patch(self.state, message["payload"]["ops"])
+            self.resolve(message)
+            if msg_type in ("GAME_CREATED", "JOINED_GAME"): self.me = message["payload"]["playerId"]
+            elif msg_type == "ERROR": self.stats.errors += 1
+            elif msg_type == "OPPONENT_LEFT": raise ConnectionError("mesa cerrada por el oponente")
+            elif msg_type == "REDIRECT": # modo --workers: la mesa esta en otro proceso
+                await self.ws.close(); await self.connect(self.uri.rsplit(":", 1)[0] + f":{message['payload']['port']}")
+                await self.send("JOIN_GAME_REQUEST", {**message["payload"], "fallback": True}, lambda m: m["type"] in ("GAME_CREATED", "JOINED_GAME", "ERROR"))
+            elif msg_type.startswith("GAME_STATE") and self.state is not None: await self.act()
+    async def act(self):# decide segun el ultimo estado; solo un mensaje propio en vuelo a la vez
+        phase = self.state["gamePhase"]; seat = self.my_seat()
+        if phase == "ROUND_OVER" and self.last_phase != "ROUND_OVER":
+            self.rounds_done += 1
+            if self.me == "player1": self.stats.rounds += 1
+        self.last_phase = phase
+        if self.pending or not self.me: return
+        if phase == "BETTING" and not seat.get("currentBet"):
+            await self.send("PLACE_BET", {"amount": self.bet}, lambda m: self.state_is(m, lambda: self.my_seat().get("currentBet") or self.state["gamePhase"] != "BETTING"))
+        elif phase == f"{self.me.upper()}_TURN" and not seat.get("isDone"):
+            action = "HIT" if isinstance(seat.get("points"), int) and seat["points"] < 17 else "STAND"
+            cards = len(seat.get("hand", []))
+            await self.send("PLAYER_ACTION", {"action": action}, lambda m: self.state_is(m, lambda: len(self.my_seat().get("hand", [])) != cards or self.my_seat().get("isDone") or self.state["gamePhase"] != phase))
+        elif phase == "ROUND_OVER" and self.me == "player1" and self.rounds_done < self.rounds:
+            await self.send("START_NEW_ROUND_REQUEST", {}, lambda m: self.state_is(m, lambda: self.state["gamePhase"] != "ROUND_OVER"))
+
+def server_rss_bytes(pid):# RSS del servidor y sus procesos hijos (workers), leyendo /proc; None fuera de Linux
+    try:
+        import psutil
+        proc = psutil.Process(pid); return sum(p.memory_info().rss for p in [proc] + proc.children(recursive=True))
+    except ImportError: pass
+    if platform.system() != "Linux": return None
+    def rss(p):# 0 para procesos que ya terminaron (zombis sin VmRSS)
+        try:
+            with open(f"/proc/{p}/status") as f: return next((int(line.split()[1]) * 1024 for line in f if line.startswith("VmRSS:")), 0)
+        except OSError: return 0
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f: pids += [int(c) for c in f.read().split()]
+    except OSError: pass
+    return sum(rss(p) for p in pids)
+
+async def wait_for_server(uri, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with websockets.connect(uri): return
+        except OSError: await asyncio.sleep(0.2)
+    raise TimeoutError(f"El servidor no respondió en {uri}")
+
+async def run_bench(args):
+    uri = f"ws://127.0.0.1:{args.port}"; proc = None
+    if not args.external:
+        cmd = [sys.executable, SERVER_PATH, "--host", "127.0.0.1", "--port", str(args.port), "--workers", str(args.workers), "--broker-port", str(args.port - 1), "--rate-limit", "0"] # los bots juegan mucho mas rapido que una persona
+        proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL if not args.server_logs else None)
+    try:
+        await wait_for_server(uri)
+        stats = Stats(); rss_before = server_rss_bytes(proc.pid) if proc else None
+        bots = [BotClient(uri, stats, args.rounds, args.seats, args.bet, args.delta, args.timeout) for _ in range(args.clients)]
+        started = time.perf_counter(); sem = asyncio.Semaphore(args.connect_concurrency)
+        async def connect(bot):
+            async with sem: await bot.connect()
+        results = await asyncio.gather(*(connect(b) for b in bots), return_exceptions=True)
+        connect_seconds = time.perf_counter() - started
+        connected = [b for b, r in zip(bots, results) if not isinstance(r, Exception)]
+        play_started = time.perf_counter()
+        results = await asyncio.gather(*(b.play() for b in connected), return_exceptions=True)
+        play_seconds = time.perf_counter() - play_started
+        stats.failed_clients = (len(bots) - len(connected)) + sum(isinstance(r, Exception) for r in results)
+        rss_after = server_rss_bytes(proc.pid) if proc else None
+        for b in connected: await b.ws.close()
+        return {"config": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+                "connections": len(connected), "failed_clients": stats.failed_clients, "errors": stats.errors,
+                "connections_per_sec": len(connected) / connect_seconds if connect_seconds else None,
+                "rounds": stats.rounds, "rounds_per_sec": stats.rounds / play_seconds if play_seconds else None,
+                "messages_in_per_sec": stats.messages_in / play_seconds if play_seconds else None,
+                "latency": stats.latency_report(), "server_rss_bytes": {"before": rss_before, "after": rss_after}}
+    finally:
+        if proc: proc.terminate(); proc.wait()
+
+def compare(result, baseline, tolerance):# regresiones frente a una corrida anterior (throughput menor o p99 mayor que la tolerancia)
+    regressions = []
+    for key in ("connections_per_sec", "rounds_per_sec"):
+        old, new = baseline.get(key), result.get(key)
+        if old and new and new < old * (1 - tolerance): regressions.append(f"{key}: {old:.1f} -> {new:.1f}")
+    for msg_type, new in result["latency"].items():
+        old = baseline.get("latency", {}).get(msg_type)
+        if old and new["p99_ms"] > old["p99_ms"] * (1 + tolerance): regressions.append(f"{msg_type} p99: {old['p99_ms']:.2f}ms -> {new['p99_ms']:.2f}ms")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga del servidor WebSocket de Blackjack.")
+    parser.add_argument("--clients", type=int, default=1000); parser.add_argument("--rounds", type=int, default=5, help="rondas por cliente")
+    parser.add_argument("--seats", type=int, default=2, help="asientos por mesa pedidos en JOIN_GAME_REQUEST")
+    parser.add_argument("--bet", type=int, default=5); parser.add_argument("--delta", action="store_true", help="usar GAME_STATE_DELTA")
+    parser.add_argument("--port", type=int, default=18765); parser.add_argument("--workers", type=int, default=1, help="--workers del servidor")
+    parser.add_argument("--external", action="store_true", help="no lanzar server.py, usar uno ya en marcha en --port")
+    parser.add_argument("--connect-concurrency", type=int, default=200, help="conexiones abriéndose a la vez")
+    parser.add_argument("--timeout", type=float, default=30.0, help="segundos máximos sin mensajes antes de dar un cliente por colgado")
+    parser.add_argument("--server-logs", action="store_true", help="mostrar los logs del servidor")
+    parser.add_argument("--out", help="guarda el resultado en este archivo JSON"); parser.add_argument("--compare", help="JSON de una corrida anterior")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="margen antes de marcar regresión (0.10 = 10%%)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s [%(filename)s:%(lineno)d]: %(message)s')
+    result = asyncio.run(run_bench(args))
+    print(json.dumps({k: v for k, v in result.items() if k != "config"}, indent=2))
+    if args.out:
+        with open(args.out, "w") as f: json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f: regressions = compare(result, json.load(f), args.tolerance)
+        for r in regressions: logging.warning(f"Regresión: {r}")
+        if regressions: sys.exit(1)
+
+if __name__ == "__main__":
+    main()
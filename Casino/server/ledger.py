@@ -0,0 +1,94 @@
+# ledger.py: registro durable de las fichas de cada jugador (python server.py --ledger RUTA)
+# Cada apuesta y cada pago se añade como una linea JSON a RUTA (write-ahead log). Las lineas se juntan en lotes y un hilo
+# aparte las escribe con un solo fsync por lote, asi el loop nunca espera al disco.
+# Cada SNAPSHOT_EVERY entradas se guarda una foto compacta de los saldos en RUTA.snapshot y el log se vacia.
+# Al arrancar se carga la foto, se repiten las lineas del log y se devuelven las apuestas que nunca se liquidaron.
+# Cada linea guarda el saldo resultante ("b") y no solo el movimiento: repetir una linea ya aplicada no cambia nada.
+# Los saldos sin movimientos en RETENTION_SECONDS se olvidan (como mucho una vez cada PRUNE_INTERVAL, con una foto nueva).
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+
+from metrics import METRICS
+
+FLUSH_INTERVAL = 0.05 # segundos que se juntan entradas antes de escribirlas (un fsync por lote)
+SNAPSHOT_EVERY = 10_000 # entradas en el log antes de guardar una foto y vaciarlo
+RETENTION_SECONDS = 30 * 24 * 3600 # un saldo sin movimientos en este tiempo se descarta (el jugador volveria con fichas nuevas)
+PRUNE_INTERVAL = 3600 # segundos entre limpiezas de saldos viejos
+
+LEDGER_ENTRIES = METRICS.counter("blackjack_ledger_entries_total", "Entradas escritas en el ledger por operacion.", ("op",))
+LEDGER_PRUNED = METRICS.counter("blackjack_ledger_pruned_total", "Saldos descartados por llevar RETENTION_SECONDS sin movimientos.")
+LEDGER_FLUSH_SECONDS = METRICS.histogram("blackjack_ledger_flush_seconds", "Tiempo en escribir y sincronizar un lote del ledger.")
+
+class ChipLedger:
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL, snapshot_every=SNAPSHOT_EVERY, retention=RETENTION_SECONDS):
+        self.path = path; self.snapshot_path = path + ".snapshot"; self.flush_interval = flush_interval; self.snapshot_every = snapshot_every
+        self.retention = retention; self.pruned_at = time.time()
+        self.balances = {}  # resumeToken -> fichas tras su ultima operacion
+        self.open_bets = {} # resumeToken -> apuesta hecha y aun sin liquidar
+        self.last_seen = {} # resumeToken -> instante (time.time) de su ultima operacion
+        self.pending = []   # lineas sin escribir
+        self.logged = 0     # entradas en el log desde la ultima foto
+        self.write_lock = threading.Lock(); self.wakeup = None; self.task = None
+    def balance(self, player_id): return self.balances.get(player_id)
+    def apply(self, entry):
+        self.balances[entry["p"]] = entry["b"]; self.last_seen[entry["p"]] = entry["t"]
+        if entry["op"] == "bet": self.open_bets[entry["p"]] = entry["a"]
+        elif entry["op"] != "seat": self.open_bets.pop(entry["p"], None) # win, push, lose y refund liquidan la apuesta
+    def record(self, op, player_id, amount, balance):# desde PlayerPython: solo memoria, la tarea run() lo escribe despues
+        entry = {"op": op, "p": player_id, "a": amount, "b": balance, "t": round(time.time(), 3)}
+        self.apply(entry); self.pending.append(json.dumps(entry)); LEDGER_ENTRIES.inc(op)
+        if self.wakeup: self.wakeup.set()
+
+    def recover(self):# al arrancar, antes de aceptar conexiones; devuelve cuantas apuestas sin liquidar se reembolsaron
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path) as f: snapshot = json.load(f)
+            self.balances = snapshot["balances"]; self.open_bets = snapshot["open_bets"]
+            self.last_seen = snapshot.get("last_seen") or dict.fromkeys(self.balances, time.time()) # fotos anteriores sin last_seen
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    try: entry = json.loads(line)
+                    except json.JSONDecodeError: logging.warning(f"Ledger: ultima linea incompleta en {self.path}, se ignora."); break
+                    self.apply(entry); self.logged += 1
+        self.prune(time.time())
+        refunds = list(self.open_bets.items()) # la ronda se perdio con el proceso: la apuesta vuelve al jugador
+        for player_id, amount in refunds: self.record("refund", player_id, amount, self.balances[player_id] + amount)
+        logging.info(f"Ledger: {len(self.balances)} saldos recuperados de {self.path}, {len(refunds)} apuestas reembolsadas.")
+        return len(refunds)
+
+    def start(self):
+        self.wakeup = asyncio.Event(); self.task = asyncio.get_running_loop().create_task(self.run())
+        if self.pending: self.wakeup.set()
+    async def run(self):# group commit: espera flush_interval desde la primera entrada nueva y escribe todo lo acumulado
+        try:
+            while True:
+                await self.wakeup.wait(); await asyncio.sleep(self.flush_interval); self.wakeup.clear()
+                started = time.perf_counter(); await asyncio.to_thread(self.write, *self.take())
+                LEDGER_FLUSH_SECONDS.observe(time.perf_counter() - started)
+        finally: self.write(*self.take()) # al parar el servidor no se pierde el ultimo lote
+    def prune(self, now):# olvida los saldos sin movimientos en retention (nunca uno con apuesta abierta); devuelve cuantos
+        self.pruned_at = now; cutoff = now - self.retention
+        stale = [p for p, seen in self.last_seen.items() if seen < cutoff and p not in self.open_bets]
+        for p in stale: del self.balances[p]; del self.last_seen[p]
+        if stale: LEDGER_PRUNED.inc(amount=len(stale)); logging.info(f"Ledger: {len(stale)} saldos sin movimientos descartados.")
+        return len(stale)
+    def take(self):# lote a escribir y, si toca, la foto de los saldos tal como quedan con ese lote
+        batch = self.pending; self.pending = []; self.logged += len(batch); snapshot = None
+        now = time.time(); pruned = self.prune(now) if now - self.pruned_at >= PRUNE_INTERVAL else 0
+        if self.logged >= self.snapshot_every or pruned: # con saldos descartados la foto nueva es la que los quita del disco
+            snapshot = {"balances": dict(self.balances), "open_bets": dict(self.open_bets), "last_seen": dict(self.last_seen)}; self.logged = 0
+        return batch, snapshot
+    def write(self, batch, snapshot):# en un hilo: añade el lote al log; con foto, la reemplaza de forma atomica y vacia el log
+        with self.write_lock:
+            if batch:
+                with open(self.path, "a") as f: f.write("\n".join(batch) + "\n"); f.flush(); os.fsync(f.fileno())
+            if snapshot is not None:
+                tmp_path = self.snapshot_path + ".tmp"
+                with open(tmp_path, "w") as f: json.dump(snapshot, f); f.flush(); os.fsync(f.fileno())
+                os.replace(tmp_path, self.snapshot_path)
+                with open(self.path, "w") as f: os.fsync(f.fileno()) # si se corta antes de esto, repetir el log no cambia la foto
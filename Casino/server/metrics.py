@@ -0,0 +1,76 @@
+# metrics.py: registro de metricas en memoria del servidor (contadores, gauges e histogramas de latencia)
+# Actualizar una metrica es solo sumar en un dict, sin I/O, para poder usarlas en cada mensaje.
+# serve_metrics() expone todo en formato de texto de Prometheus en http://127.0.0.1:<puerto>/metrics
+
+import asyncio
+import bisect
+import logging
+
+# limites de los buckets de latencia en segundos (50us ... 5s)
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+def format_labels(names, values):
+    if not names: return ""
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, values)) + "}"
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name; self.help = help_text; self.label_names = labels; self.values = {}
+    def inc(self, *label_values, amount=1): self.values[label_values] = self.values.get(label_values, 0) + amount
+    def get(self, *label_values): return self.values.get(label_values, 0)
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{format_labels(self.label_names, k)} {v}" for k, v in sorted(self.values.items())]
+        if not self.label_names and not self.values: lines.append(f"{self.name} 0") # sin etiquetas se exporta aunque no haya ocurrido
+        return lines
+
+class Gauge:# valor leido al momento de exportar (len de un dict, etc.), no cuesta nada en el camino caliente
+    def __init__(self, name, help_text, read): self.name = name; self.help = help_text; self.read = read
+    def render(self): return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {self.read()}"]
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name; self.help = help_text; self.label_names = labels; self.buckets = buckets
+        self.series = {} # valores de etiquetas -> [cuentas por bucket (+Inf al final), suma, total]
+    def observe(self, seconds, *label_values):
+        series = self.series.get(label_values)
+        if series is None: series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, seconds)] += 1; series[1] += seconds; series[2] += 1
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_values, (counts, total, count) in sorted(self.series.items()):
+            cumulative = 0
+            for bound, c in zip(list(self.buckets) + ["+Inf"], counts):
+                cumulative += c
+                lines.append(f"{self.name}_bucket{format_labels(self.label_names + ('le',), label_values + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.label_names, label_values)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.label_names, label_values)} {count}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self): self.metrics = []
+    def counter(self, name, help_text, labels=()): return self.add(Counter(name, help_text, labels))
+    def gauge(self, name, help_text, read): return self.add(Gauge(name, help_text, read))
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS): return self.add(Histogram(name, help_text, labels, buckets))
+    def add(self, metric): self.metrics.append(metric); return metric
+    def render(self): return "\n".join(line for m in self.metrics for line in m.render()) + "\n"
+
+METRICS = MetricsRegistry() # registro del proceso
+
+async def handle_http(registry, reader, writer):# HTTP minimo: GET /metrics, lo demas 404
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""): pass # cabeceras, se ignoran
+        parts = request_line.decode(errors="replace").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] in ("/metrics", "/"):
+            body = registry.render().encode(); status = "200 OK"
+        else: body = b"not found\n"; status = "404 Not Found"
+        writer.write(f"HTTP/1.0 {status}\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+        await writer.drain()
+    except ConnectionError: pass
+    finally: writer.close()
+
+async def serve_metrics(port, host="127.0.0.1", registry=METRICS):# arranca el endpoint de metricas en el loop actual
+    server = await asyncio.start_server(lambda r, w: handle_http(registry, r, w), host, port)
+    logging.info(f"Métricas en http://{host}:{port}/metrics")
+    return server
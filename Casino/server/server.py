@@ -5,54 +5,178 @@ import json
 import websockets
 import logging
 import uuid
+import secrets
 import random
+import collections
+import argparse
+import atexit
+import queue
+import time
+import logging.handlers
+from array import array
 from websockets.protocol import State
+from metrics import METRICS, serve_metrics
+from timer_wheel import TimerWheel
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s [%(filename)s:%(lineno)d]: %(message)s')
+LOG_FORMAT = '%(asctime)s %(levelname)s [%(filename)s:%(lineno)d]: %(message)s'
+logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+# logs del camino caliente (cada mensaje, cada estado, cada ronda): en DEBUG o INFO muestreado con --log-sample
+# usan argumentos %s en vez de f-strings para no formatear nada si el nivel esta apagado
+HOT_LOG = logging.getLogger("blackjack.hot")
 
+class SampledFilter(logging.Filter):# deja pasar solo una fraccion de los registros por debajo de WARNING
+    def __init__(self, rate): super().__init__(); self.rate = rate; self.rng = random.Random()
+    def filter(self, record): return record.levelno >= logging.WARNING or self.rng.random() < self.rate
 
+def setup_logging(level="INFO", sample=1.0, fmt=LOG_FORMAT):# el loop solo encola cada registro; un hilo aparte escribe en stderr
+    log_queue = queue.SimpleQueue(); handler = logging.StreamHandler(); handler.setFormatter(logging.Formatter(fmt))
+    listener = logging.handlers.QueueListener(log_queue, handler); listener.start(); atexit.register(listener.stop)
+    root = logging.getLogger(); root.handlers = [logging.handlers.QueueHandler(log_queue)]; root.setLevel(level)
+    if sample < 1: HOT_LOG.addFilter(SampledFilter(sample))
+    logging.getLogger("websockets").setLevel(logging.INFO) # en DEBUG websockets escribe cada trama, con los resumeToken que lleven
+    return listener
 
-class Card:#Define cómo es una carta
-    def __init__(self, suit, value): self.suit = suit; self.value = value
+# --- Metricas (ver metrics.py; se exportan con --metrics-port) ---
+MESSAGES_TOTAL = METRICS.counter("blackjack_messages_total", "Mensajes recibidos por tipo.", ("type",))
+MESSAGE_SECONDS = METRICS.histogram("blackjack_message_seconds", "Tiempo de proceso de un mensaje por tipo.", ("type",))
+MESSAGE_ERRORS = METRICS.counter("blackjack_message_errors_total", "Mensajes que no se pudieron procesar.", ("reason",))
+BROADCAST_SECONDS = METRICS.histogram("blackjack_broadcast_seconds", "Tiempo en codificar y encolar un estado a toda la mesa.")
+STATE_MESSAGES = METRICS.counter("blackjack_state_messages_total", "Estados encolados por formato.", ("mode",))
+SHOE_RESHUFFLES = METRICS.counter("blackjack_shoe_reshuffles_total", "Zapatos barajados de nuevo (carta de corte o zapato vacio).")
+OUTBOX_COALESCED = METRICS.counter("blackjack_outbox_coalesced_total", "Estados sin enviar reemplazados por uno mas nuevo.")
+OUTBOX_DROPS = METRICS.counter("blackjack_outbox_drops_total", "Clientes desconectados por acumular demasiados mensajes.")
+TABLE_COMMAND_SECONDS = METRICS.histogram("blackjack_table_command_seconds", "Tiempo de proceso de un comando en el actor de la mesa.", ("type",))
+TABLE_QUEUE_SECONDS = METRICS.histogram("blackjack_table_queue_seconds", "Espera de un comando en la bandeja de la mesa.")
+SESSION_EVENTS = METRICS.counter("blackjack_session_events_total", "Desconexiones, reanudaciones y asientos liberados.", ("event",))
+TIMEOUTS = METRICS.counter("blackjack_timeouts_total", "Plazos vencidos: turno (STAND automatico), apuestas (fuera de la ronda), gracia de reconexion.", ("kind",))
+TABLES_EVICTED = METRICS.counter("blackjack_tables_evicted_total", "Mesas cerradas por el reloj.", ("reason",))
+HINTS = METRICS.counter("blackjack_hints_total", "Pistas HINT_REQUEST respondidas por modo.", ("mode",))
+RATE_LIMITED = METRICS.counter("blackjack_rate_limited_total", "Mensajes rechazados por superar el limite de la conexion.")
+
+OUTBOX_MAX_BACKLOG = 64 # mensajes pendientes por conexion; si un cliente lento acumula mas, se le desconecta
+
+class ClientOutbox:# cola de salida de una conexion: la mesa encola y una tarea aparte envia, asi un cliente lento no frena el juego
+    def __init__(self, websocket, max_backlog=OUTBOX_MAX_BACKLOG):
+        self.websocket = websocket; self.max_backlog = max_backlog; self.closed = False
+        self.pending = collections.deque() # (texto, es_estado)
+        self.wakeup = asyncio.Event(); self.task = asyncio.get_running_loop().create_task(self.run())
+    def put(self, text, is_state=False, resync_text=None):# encola sin bloquear; devuelve False si la conexion ya no acepta mensajes
+        # resync_text: snapshot completo a usar si este estado (un delta) reemplaza a otro sin enviar, porque el delta descartado rompe la cadena
+        if self.closed: return False
+        if is_state and self.pending and self.pending[-1][1]: self.pending[-1] = (resync_text or text, True); OUTBOX_COALESCED.inc(); return True # estado viejo sin enviar: solo vale el ultimo
+        if len(self.pending) >= self.max_backlog:
+            logging.warning(f"OUTBOX: {self.websocket.remote_address} superó {self.max_backlog} mensajes pendientes. Desconectando."); OUTBOX_DROPS.inc(); self.close(drop=True); return False
+        self.pending.append((text, is_state)); self.wakeup.set(); return True
+    async def run(self):# envia en orden lo que haya en la cola
+        try:
+            while True:
+                while not self.pending: self.wakeup.clear(); await self.wakeup.wait()
+                await self.websocket.send(self.pending.popleft()[0])
+        except websockets.exceptions.ConnectionClosed: logging.warning(f"OUTBOX: Conn cerrada {self.websocket.remote_address}")
+        finally: self.closed = True; self.pending.clear()
+    def close(self, drop=False):# deja de enviar; con drop=True ademas cierra el socket (cliente demasiado lento)
+        self.closed = True; self.pending.clear(); self.task.cancel()
+        if drop: asyncio.get_running_loop().create_task(self.websocket.close(code=1008, reason="Cliente demasiado lento."))
+
+
+
+SUITS = ['Hearts', 'Diamonds', 'Clubs', 'Spades']; VALUES = ['2', '3', '4', '5', '6', '7', '8', '9', '10', 'J', 'Q', 'K', 'A']
+SHOE_DECKS = 1 # barajas por zapato
+SHOE_PENETRATION = 0.75 # fraccion del zapato que se reparte antes de la carta de corte (reshuffle al empezar la siguiente ronda)
+DEALER_STANDS_ON = 17 # el crupier pide carta mientras tenga menos (se planta con 17 blando)
+BLACKJACK_PAYOUT = 1.5 # el blackjack paga 3:2 (se trunca a fichas enteras)
+DEFAULT_TABLE_SEATS = 2 # asientos por mesa si el cliente no pide otro tamaño
+MAX_TABLE_SEATS = 5
+STAKE_BUCKETS = {"low": (1, 10), "standard": (1, 100), "high": (25, 100)} # nivel de apuestas -> (apuesta minima, maxima)
+DEFAULT_STAKE = "standard"
+TABLE_LIST_LIMIT = 50 # mesas devueltas como maximo en TABLE_LIST
+TABLE_INBOX_SIZE = 32 # comandos en espera por mesa; con la bandeja llena la conexion que envia espera (deja de leer su socket)
+CLIENT_RATE_LIMIT = 20 # mensajes por segundo por conexion (token bucket); 0 = sin limite
+CLIENT_RATE_BURST = 40 # rafaga permitida por encima del ritmo
+MAX_MESSAGE_BYTES = 4096 # tamaño maximo de un mensaje del cliente; websockets cierra la conexion si lo supera
+RESUME_GRACE_SECONDS = 30 # tiempo que se guarda el asiento de un jugador desconectado para RESUME_SESSION; 0 = la mesa se cierra al momento
+TURN_TIMEOUT_SECONDS = 30 # sin PLAYER_ACTION en este tiempo el jugador se planta solo; 0 = sin limite
+BETTING_TIMEOUT_SECONDS = 45 # quien no apuesta en este tiempo queda fuera de la ronda; si nadie apostó, la mesa se cierra
+IDLE_TABLE_SECONDS = 300 # mesas esperando jugadores o con la ronda terminada sin actividad se cierran
+LEDGER_PATH = None # ruta del ledger de fichas (--ledger); None = las fichas solo viven en memoria
+STRATEGY_TABLE_PATH = None # tabla de EV precalculada para HINT_REQUEST (--strategy-table); None = se calcula al arrancar
+HINT_MODES = ("table", "shoe") # "table": zapato recien barajado (consulta O(1)); "shoe": con las cartas que quedan en el zapato
+
+class Card:#Define cómo es una carta. Hay una sola instancia por codigo (0-51), compartida por todos los zapatos
+    __slots__ = ("suit", "value", "code", "points", "is_ace", "rank", "as_dict")
+    def __init__(self, suit, value, code=None):
+        self.suit = suit; self.value = value; self.code = code; self.is_ace = value == 'A'
+        self.points = 11 if self.is_ace else 10 if value in ('J', 'Q', 'K') else int(value) # el As cuenta 11, la mano lo baja a 1 si hace falta
+        self.rank = 1 if self.is_ace else self.points # rango para contar el zapato (1 = As, 10 = 10/J/Q/K)
+        self.as_dict = {"suit": suit, "value": value} # formato JSON precalculado, no modificar
     def __str__(self): return f"{self.value}{self.suit[0]}"
-    def to_dict(self): return {"suit": self.suit, "value": self.value}# metodo para convertir la carta a un formanto JSON
-class DeckPython:#mazo de cartas, puede tener varias barajas
-    #Define cómo es un mazo. Sabe cuántas barajas usar, cuáles son todos los palos y valores posibles.
-    def __init__(self, num_decks=1): self.cards = []; self.num_decks = num_decks; self.suits = ['Hearts', 'Diamonds', 'Clubs', 'Spades']; self.values = ['2', '3', '4', '5', '6', '7', '8', '9', '10', 'J', 'Q', 'K', 'A']; self.build(); self.shuffle()
-    def build(self): self.cards = []; [self.cards.append(Card(s, v)) for _ in range(self.num_decks) for s in self.suits for v in self.values]# crea el mazo de cartas
-    def shuffle(self): random.shuffle(self.cards)# barajar el mazo
-    def deal(self):# saca una carta del mazo
-        # Si el mazo está vacío, se crea un nuevo mazo y lo baraja de nuevo.
-        if not self.cards: logging.warning("Mazo vacío..."); self.build(); self.shuffle()
-        return self.cards.pop() if self.cards else None
+    def to_dict(self): return self.as_dict# metodo para convertir la carta a un formanto JSON
+CARDS = tuple(Card(s, v, i) for i, (s, v) in enumerate((s, v) for s in SUITS for v in VALUES)) # tabla codigo -> carta
+HIDDEN_CARD = {"suit": "Hidden", "value": "?"}
+
+class DeckPython:#zapato de cartas, puede tener varias barajas. Se reutiliza entre rondas
+    #Guarda los codigos de carta en un array prealocado y reparte avanzando una posicion; baraja de nuevo al pasar la carta de corte.
+    def __init__(self, num_decks=SHOE_DECKS, penetration=SHOE_PENETRATION):
+        self.num_decks = num_decks; self.penetration = penetration; self.reshuffles = 0
+        self.cards = array('B', range(len(CARDS))) * num_decks; self.cut_card = int(len(self.cards) * penetration)
+        self.shuffle()
+    def shuffle(self):# barajar el zapato completo
+        random.shuffle(self.cards); self.position = 0
+        self.rank_counts = [0] + [4 * self.num_decks] * 9 + [16 * self.num_decks] # cartas por rango que quedan por salir (indice = Card.rank)
+    def reshuffle(self): self.shuffle(); self.reshuffles += 1; SHOE_RESHUFFLES.inc()
+    def needs_reshuffle(self): return self.position >= self.cut_card
+    def reshuffle_if_needed(self):# entre rondas: baraja solo si ya salio la carta de corte
+        if self.needs_reshuffle(): self.reshuffle(); return True
+        return False
+    def cards_left(self): return len(self.cards) - self.position
+    def deal(self):# saca una carta del zapato
+        # Si el zapato está vacío (ronda larga pasada la carta de corte), se baraja de nuevo.
+        if self.position >= len(self.cards): logging.warning("Zapato vacío..."); self.reshuffle()
+        card = CARDS[self.cards[self.position]]; self.position += 1; self.rank_counts[card.rank] -= 1
+        return card
 class PlayerPython:# Define cómo es un jugador, sus cartas, fichas, apuestas y acciones
+    __slots__ = ("websocket", "id_in_game", "server_player_id", "resume_token", "name", "chips", "hand", "current_bet", "is_done", "is_bust", "has_blackjack", "round_message", "hand_total", "soft_aces", "sitting_out")
     def __init__(self, websocket, player_id_in_game, name, initial_chips=100):
         self.websocket = websocket; self.id_in_game = player_id_in_game; self.server_player_id = str(uuid.uuid4()); self.name = name
+        self.resume_token = None # secreto del asiento (add_player): solo lo conoce su dueño, sirve para RESUME_SESSION y para recuperar el saldo
         self.chips = initial_chips; self.hand = []; self.current_bet = 0; self.is_done = False; self.is_bust = False; self.has_blackjack = False; self.round_message = ""
-    def add_card(self, card): self.hand.append(card); self.update_status()#Recibe una carta y la añade a su mano. Luego llama a "update_status()."
-    def get_hand_value(self):#Suma los puntos de sus cartas. Sabe que las J, Q, K valen 10 y que el As puede valer 1 u 11
-        val, aces = 0, 0
-        for c in self.hand:
-            if c.value in ['J','Q','K']: val+=10
-            elif c.value == 'A': val+=11; aces+=1
-            else: val += int(c.value)
-        while val > 21 and aces > 0: val-=10; aces-=1
-        return val
-    def update_status(self): hv=self.get_hand_value(); self.is_bust=hv>21; self.has_blackjack=(hv==21 and len(self.hand)==2); self.is_done = True if self.is_bust else self.is_done 
+        self.hand_total = 0; self.soft_aces = 0 # total de la mano y Ases que aun cuentan 11, actualizados en cada carta
+        self.sitting_out = False # no apostó a tiempo: no recibe cartas esta ronda
+    def add_card(self, card):#Recibe una carta y la añade a su mano. Luego llama a "update_status()."
+        self.hand.append(card); self.hand_total += card.points
+        if card.is_ace: self.soft_aces += 1
+        while self.hand_total > 21 and self.soft_aces: self.hand_total -= 10; self.soft_aces -= 1 # un As pasa de 11 a 1
+        self.update_status()
+    def get_hand_value(self): return self.hand_total#Puntos de sus cartas (J, Q, K valen 10 y el As 1 u 11), calculados al recibir cada carta
+    def is_soft(self): return self.soft_aces > 0# la mano tiene un As contando 11
+    def update_status(self): hv=self.hand_total; self.is_bust=hv>21; self.has_blackjack=(hv==21 and len(self.hand)==2); self.is_done = True if self.is_bust else self.is_done 
     #   Después de recibir una carta o al inicio, revisa si se pasó de 21 o si tiene Blackjack.
+    # cada movimiento de fichas se apunta en el ledger (si hay --ledger) con el saldo que queda
     def place_bet(self, amount):
         if amount<=0 or amount>self.chips: self.round_message="Apuesta inválida."; return False
-        self.chips-=amount; self.current_bet=amount; self.round_message=f"Apostó {amount}F."; return True
-    def win_bet(self, bj=False): self.chips += self.current_bet + (int(self.current_bet*1.5) if bj else self.current_bet)
-    def lose_bet(self): pass
-    def push_bet(self): self.chips += self.current_bet
-    def reset_for_new_round(self): self.hand=[]; self.current_bet=0; self.is_done=False; self.is_bust=False; self.has_blackjack=False; self.round_message=""
+        self.chips-=amount; self.current_bet=amount; self.round_message=f"Apostó {amount}F."
+        if LEDGER: LEDGER.record("bet", self.resume_token, amount, self.chips)
+        return True
+    def win_bet(self, bj=False):
+        payout = self.current_bet + (int(self.current_bet*BLACKJACK_PAYOUT) if bj else self.current_bet); self.chips += payout
+        if LEDGER: LEDGER.record("win", self.resume_token, payout, self.chips)
+    def lose_bet(self):
+        if LEDGER: LEDGER.record("lose", self.resume_token, 0, self.chips)
+    def push_bet(self):
+        self.chips += self.current_bet
+        if LEDGER: LEDGER.record("push", self.resume_token, self.current_bet, self.chips)
+    def refund_bet(self):# la mesa se cerro con la ronda a medias: la apuesta vuelve al jugador
+        self.chips += self.current_bet
+        if LEDGER: LEDGER.record("refund", self.resume_token, self.current_bet, self.chips)
+        self.current_bet = 0
+    def reset_for_new_round(self): self.hand=[]; self.hand_total=0; self.soft_aces=0; self.current_bet=0; self.is_done=False; self.is_bust=False; self.has_blackjack=False; self.round_message=""; self.sitting_out=False
+    def sit_out(self): self.sitting_out=True; self.is_done=True; self.round_message="No apostó a tiempo. Fuera esta ronda."
     #limpia la ronda para al siguientes ronda
     def to_dict(self, reveal_hand=True):# prepara un diccionario con la información del jugador, para enviar al cliente
         chips_to_send = None if self.id_in_game == "crupier" else self.chips
         hand_to_show = []
-        if reveal_hand: hand_to_show = [card.to_dict() for card in self.hand]
-        elif self.hand: hand_to_show = [self.hand[0].to_dict()] + ([{"suit": "Hidden", "value": "?"}] if len(self.hand) > 1 else [])
+        if reveal_hand: hand_to_show = [card.as_dict for card in self.hand]
+        elif self.hand: hand_to_show = [self.hand[0].as_dict] + ([HIDDEN_CARD] if len(self.hand) > 1 else [])
         points_to_show = "?"
         if reveal_hand or (self.id_in_game == "crupier" and (self.has_blackjack or self.is_done)): points_to_show = self.get_hand_value()
         elif self.id_in_game != "crupier": points_to_show = self.get_hand_value()
@@ -60,75 +184,158 @@ class PlayerPython:# Define cómo es un jugador, sus cartas, fichas, apuestas y
                 "isDone":self.is_done,"isBust":self.is_bust,"hasBlackjack":self.has_blackjack,"roundMessage":self.round_message}
 
 class BlackjackGamePython:# partida del blackjack
-    def __init__(self, game_id, p1_ws):# necesita id partida y conexion del primer jugador,
-        #el prepara todo para que el segundo llegue
-        self.game_id=game_id; self.deck=DeckPython(); self.player1=PlayerPython(p1_ws,"player1","Jugador 1")
-        self.player2=None; self.crupier=PlayerPython(None,"crupier","Crupier",float('inf'))
-        self.players_in_game={p1_ws:self.player1}; self.game_phase="WAITING_FOR_PLAYER2"#control de apuestas
-        self.bets_placed={"player1":False,"player2":False}# aqui se sabe quien aposto
-        logging.info(f"Juego {self.game_id} por P1({self.player1.server_player_id}). Esperando P2.")
-    def add_player2(self, p2_ws):#añade al segndo jugador
-        if not self.player2:
-            self.player2=PlayerPython(p2_ws,"player2","Jugador 2"); self.players_in_game[p2_ws]=self.player2
-            self.game_phase="BETTING"; logging.info(f"P2({self.player2.server_player_id}) se unió {self.game_id}. Fase Apuestas."); return True
-        return False
-    async def broadcast_game_state(self, spec_ws=None):
+    def __init__(self, game_id, p1_ws, num_seats=DEFAULT_TABLE_SEATS, stake=DEFAULT_STAKE, p1_returning=None):# necesita id partida y conexion del primer jugador,
+        #el prepara todo para que lleguen los demas (num_seats asientos, apuestas segun el nivel stake)
+        self.game_id=game_id; self.deck=DeckPython(); self.num_seats=num_seats; self.stake=stake; self.min_bet,self.max_bet=STAKE_BUCKETS[stake]
+        self.seats=[]; self.crupier=PlayerPython(None,"crupier","Crupier",float('inf'))
+        self.players_in_game={}; self.bets_placed={}# aqui se sabe quien aposto
+        self.state_seq=0; self.last_state=None; self.last_full_text=None # ultimo snapshot enviado, base de los deltas
+        self.delta_synced=set() # conexiones que ya recibieron un snapshot de esta mesa y pueden recibir deltas
+        self.inbox=asyncio.Queue(TABLE_INBOX_SIZE); self.closed=False # bandeja del actor: los comandos de la mesa se procesan de uno en uno
+        self.actor_task=asyncio.get_running_loop().create_task(self.run_actor())
+        self.grace_timers={} # PlayerPython desconectado -> temporizador que libera la mesa si no vuelve
+        self.deadline=None; self.deadline_phase=None; self.clock_timer=None; self.clock_due=None; self.finished=False # plazo de la fase actual (ver touch_clock) y fin del actor
+        self.add_player(p1_ws, p1_returning)
+        logging.info(f"Juego {self.game_id} ({self.num_seats} asientos, {self.stake}) por P1({self.player1.server_player_id}). Fase {self.game_phase}.")
+    @property
+    def player1(self): return self.seats[0] if self.seats else None
+    @property
+    def player2(self): return self.seats[1] if len(self.seats) > 1 else None
+    def is_full(self): return len(self.seats) >= self.num_seats
+    def add_player(self, ws, returning=None):#sienta a un jugador en el siguiente asiento libre; con la mesa llena empiezan las apuestas
+        # returning: (resumeToken, fichas) de un jugador que vuelve con su saldo del ledger
+        if self.is_full(): return None
+        n=len(self.seats)+1; p_obj=PlayerPython(ws,f"player{n}",f"Jugador {n}")
+        if returning: p_obj.resume_token, p_obj.chips = returning
+        else: p_obj.resume_token = new_resume_token()
+        if LEDGER and returning: LEDGER.record("seat", p_obj.resume_token, 0, p_obj.chips) # un jugador nuevo entra al ledger con su primera apuesta
+        self.seats.append(p_obj); self.players_in_game[ws]=p_obj; self.bets_placed[p_obj.id_in_game]=False
+        self.game_phase="BETTING" if self.is_full() else f"WAITING_FOR_PLAYER{n+1}"
+        if n > 1: logging.info(f"P{n}({p_obj.server_player_id}) se unió {self.game_id}. Fase {self.game_phase}.")
+        return p_obj
+    async def submit(self, cmd_type, handler, *args):# encola un comando para el actor; con la bandeja llena espera (contrapresion sobre la conexion)
+        if self.closed: return False
+        await self.inbox.put((cmd_type, handler, args, time.perf_counter())); return True
+    async def close(self, p_disc, message="Oponente abandonó."):# la mesa deja de aceptar comandos; el aviso a los demas asientos sale detras de lo ya encolado
+        self.closed = True
+        if self.clock_timer: self.clock_timer.cancel(); self.clock_timer = None
+        if asyncio.current_task() is self.actor_task: self.finish(p_disc, message) # desde un comando del propio actor (reloj)
+        else: await self.inbox.put(("LEFT", None, (p_disc, message), time.perf_counter()))
+    def finish(self, p_disc, message): self.refund_open_bets(); self.notify_player_left(p_disc, message); self.finished = True
+    async def run_actor(self):# unico lugar donde se ejecutan los comandos de la mesa: nunca hay dos a la vez sobre el mismo estado
+        while not self.finished:
+            cmd_type, handler, args, queued_at = await self.inbox.get()
+            started = time.perf_counter(); TABLE_QUEUE_SECONDS.observe(started - queued_at)
+            try:
+                if handler is None: self.finish(*args)
+                else: await handler(self, *args)
+            except Exception: logging.exception(f"J{self.game_id}: Error procesando {cmd_type}")
+            finally: TABLE_COMMAND_SECONDS.observe(time.perf_counter() - started, cmd_type)
+        while not self.inbox.empty(): self.inbox.get_nowait() # libera a quien espere en put(); la mesa ya no procesa nada
+    def refund_open_bets(self):# al cerrar la mesa: apuestas hechas en una ronda que ya no se va a terminar
+        for p_obj in self.seats:
+            if LEDGER and p_obj.resume_token in LEDGER.open_bets: p_obj.refund_bet()
+    def notify_player_left(self, p_disc, message):# avisa a los demas asientos (a todos si la cerro el reloj)
+        for other_player in self.seats:
+            if other_player is not p_disc and other_player.websocket and other_player.websocket.state==State.OPEN:
+                send_message(other_player.websocket, "OPPONENT_LEFT", {"message":message})
+    # --- Reloj de la mesa: un solo temporizador en TIMERS por mesa, reprogramado de forma perezosa ---
+    # Cada cambio de estado solo mueve self.deadline; cuando el temporizador vence y el plazo se movio mas tarde, se vuelve a armar
+    # por lo que falta. Asi un mensaje en la misma fase no cuesta ni cancelar ni crear temporizadores. Si el plazo nuevo es
+    # anterior (p. ej. de la espera de 300s a los 45s de apuestas), el temporizador se cancela y se arma de nuevo.
+    def phase_timeout(self):# segundos que puede durar la fase actual sin que nadie haga nada (0 = sin limite)
+        if self.game_phase == "BETTING": return BETTING_TIMEOUT_SECONDS
+        if self.game_phase == "ROUND_OVER" or self.game_phase.startswith("WAITING"): return IDLE_TABLE_SECONDS
+        if self.game_phase.endswith("_TURN") and self.game_phase != "CRUPIER_TURN": return TURN_TIMEOUT_SECONDS
+        return 0
+    def touch_clock(self):# despues de cada cambio de estado: la fase tiene un plazo nuevo
+        timeout = self.phase_timeout(); self.deadline = time.monotonic() + timeout if timeout else None; self.deadline_phase = self.game_phase
+        if self.clock_timer and self.deadline is not None and self.deadline < self.clock_due: self.clock_timer.cancel(); self.clock_timer = None
+        self.arm_clock()
+    def arm_clock(self):
+        if self.deadline is not None and self.clock_timer is None and not self.closed:
+            self.clock_due = self.deadline; self.clock_timer = TIMERS.call_later(self.deadline - time.monotonic(), self.on_clock)
+    def on_clock(self):# llamado por la rueda; si el plazo vencio de verdad, el actor resuelve el timeout en orden con los demas comandos
+        self.clock_timer = None
+        if self.closed or self.deadline is None: return
+        if time.monotonic() < self.deadline: self.arm_clock(); return
+        asyncio.get_running_loop().create_task(self.submit("TIMEOUT", on_phase_timeout, None, None, None))
+    def detach_player(self, p_obj):# la conexion del asiento se cayo: el asiento se guarda sin socket hasta que vuelva o venza la gracia
+        self.players_in_game.pop(p_obj.websocket, None); self.delta_synced.discard(p_obj.websocket); p_obj.websocket = None
+    def attach_player(self, ws, p_obj):# RESUME_SESSION: el asiento pasa a la conexion nueva
+        timer = self.grace_timers.pop(p_obj, None)
+        if timer: timer.cancel()
+        p_obj.websocket = ws; self.players_in_game[ws] = p_obj
+    def next_turn_phase(self):# turno del primer asiento que no ha terminado; si todos terminaron, le toca al crupier
+        for p_obj in self.seats:
+            if not p_obj.is_done: return f"{p_obj.id_in_game.upper()}_TURN"
+        return "CRUPIER_TURN"
+    async def broadcast_game_state(self):
         # envia en voz la informacion actualizada del juego a todos los jugadores conectados
+        # todos los asientos ven lo mismo, asi que el estado se codifica una sola vez y se encola en cada conexion
+        started = time.perf_counter()
+        rev_crup = (self.crupier.is_done or self.crupier.has_blackjack or self.game_phase=="ROUND_OVER")
+        state={"gameId":self.game_id,"gamePhase":self.game_phase,"tableSize":self.num_seats,"stake":self.stake,"minBet":self.min_bet,"maxBet":self.max_bet}
+        for i in range(self.num_seats): state[f"player{i+1}"]=self.seats[i].to_dict(True) if i < len(self.seats) else None # asientos vacios van como null
+        state["crupier"]=self.crupier.to_dict(rev_crup); state["currentTurn"]=self.game_phase if "TURN" in self.game_phase else None
+        prev_state = self.last_state; self.state_seq += 1; self.last_state = state
+        text = self.last_full_text = json.dumps({"type":"GAME_STATE_UPDATE","seq":self.state_seq,"payload":state})
+        delta_text = None # el delta solo se codifica si alguna conexion lo va a usar
         for ws, p_obj_loop in self.players_in_game.items():
             if not ws: continue
             if ws.state != State.OPEN: logging.warning(f"BC_STATE: Socket {p_obj_loop.server_player_id} no abierto. Saltando."); continue
-            rev_crup = (self.crupier.is_done or self.crupier.has_blackjack or self.game_phase=="ROUND_OVER")
-            state={"gameId":self.game_id,"gamePhase":self.game_phase, "player1":self.player1.to_dict(True),"player2":self.player2.to_dict(True) if self.player2 else None,
-                   "crupier":self.crupier.to_dict(rev_crup), "currentTurn":self.game_phase if "TURN" in self.game_phase else None}
-            if spec_ws and ws!=spec_ws: continue
-            try: await ws.send(json.dumps({"type":"GAME_STATE_UPDATE","payload":state}))
-            except websockets.exceptions.ConnectionClosed: logging.warning(f"BC_STATE: Conn cerrada {p_obj_loop.server_player_id}")
-        if spec_ws is None: logging.info(f"J{self.game_id}: Estado enviado. Fase:{self.game_phase}")
+            if ws in DELTA_CLIENTS and ws in self.delta_synced and prev_state is not None:
+                if delta_text is None: delta_text = json.dumps({"type":"GAME_STATE_DELTA","payload":{"gameId":self.game_id,"seq":self.state_seq,"ops":diff_state(prev_state, state)}})
+                queue_text(ws, delta_text, is_state=True, resync_text=text); STATE_MESSAGES.inc("delta")
+            else: queue_text(ws, text, is_state=True); STATE_MESSAGES.inc("full")
+            self.delta_synced.add(ws)
+        BROADCAST_SECONDS.observe(time.perf_counter() - started); self.touch_clock()
+        HOT_LOG.debug("J%s: Estado enviado. Fase:%s", self.game_id, self.game_phase)
+
+    def send_full_state(self, ws):# reenvia el ultimo snapshot completo (RESYNC_REQUEST), los deltas siguientes parten de el
+        if self.last_full_text is None: return
+        queue_text(ws, self.last_full_text, is_state=True); self.delta_synced.add(ws)
 
     async def start_new_round(self):# reinicia todo para una nueva ronda
-        self.player1.reset_for_new_round(); 
-        if self.player2: self.player2.reset_for_new_round()
-        self.crupier.reset_for_new_round(); self.deck=DeckPython()
-        self.bets_placed={"player1":False,"player2":False}; self.game_phase="BETTING"
-        logging.info(f"J{self.game_id}: Nueva ronda, apuestas."); await self.broadcast_game_state()
+        for p_obj in self.seats: p_obj.reset_for_new_round()
+        self.crupier.reset_for_new_round()
+        if self.deck.reshuffle_if_needed(): logging.info(f"J{self.game_id}: Carta de corte, zapato barajado.")
+        self.bets_placed={p_obj.id_in_game:False for p_obj in self.seats}; self.game_phase="BETTING"
+        HOT_LOG.info("J%s: Nueva ronda, apuestas.", self.game_id); await self.broadcast_game_state()
 
     async def handle_bet(self, player_obj, amount):
         #Procesa la apuesta de un jugador. Si ya todos los jugadores necesarios han apostado, llama a deal_initial_cards().
-        logging.info(f"DEBUG handle_bet: Recibido para player_obj.id_in_game: {player_obj.id_in_game}, player_obj.name: {player_obj.name}") # LOG AÑADIDO
+        HOT_LOG.debug("handle_bet: %s (%s), %s", player_obj.id_in_game, player_obj.name, amount)
         if self.game_phase!="BETTING": await self.send_error_to_player(player_obj,"No es fase apuestas."); return
+        if self.bets_placed.get(player_obj.id_in_game): await self.send_error_to_player(player_obj,"Ya apostaste esta ronda."); return
+        if not isinstance(amount,int) or not self.min_bet<=amount<=self.max_bet: await self.send_error_to_player(player_obj,f"La apuesta en esta mesa es de {self.min_bet}F a {self.max_bet}F."); return
         if player_obj.place_bet(amount):
-            self.bets_placed[player_obj.id_in_game]=True; logging.info(f"J{self.game_id}: {player_obj.name} apostó {amount} (id_in_game: {player_obj.id_in_game}). Bets placed: {self.bets_placed}") # LOG MEJORADO
+            self.bets_placed[player_obj.id_in_game]=True; HOT_LOG.info("J%s: %s apostó %s (%s).", self.game_id, player_obj.name, amount, player_obj.id_in_game)
             await self.broadcast_game_state()
-            all_bets_in = (self.bets_placed.get("player1") and self.bets_placed.get("player2")) if self.player2 else self.bets_placed.get("player1")
-            logging.info(f"J{self.game_id}: Chequeando todas las apuestas: {all_bets_in}. Bets: {self.bets_placed}") # LOG AÑADIDO
+            all_bets_in = all(self.bets_placed.values())
+            HOT_LOG.debug("J%s: Todas las apuestas: %s. Bets: %s", self.game_id, all_bets_in, self.bets_placed)
             if all_bets_in: await self.deal_initial_cards()
         else: await self.send_error_to_player(player_obj, player_obj.round_message)
     
+    def active_seats(self): return [p_obj for p_obj in self.seats if not p_obj.sitting_out]# asientos que juegan esta ronda
     async def deal_initial_cards(self):# reparte las cartas a los jugadores, verifica si hay blackjack
-        logging.info(f"J{self.game_id}: Repartiendo cartas.")
+        HOT_LOG.info("J%s: Repartiendo cartas.", self.game_id)
         # ... (resto de deal_initial_cards como antes) ...
-        [p.add_card(self.deck.deal()) for _ in range(2) for p in [self.player1, self.player2, self.crupier] if p]
-        p1bj,p2bj,cbj = self.player1.has_blackjack,self.player2.has_blackjack if self.player2 else False,self.crupier.has_blackjack
-        if p1bj: self.player1.is_done=True; msg,fn="¡BJ!" if not cbj else "Empate BJ",self.player1.win_bet if not cbj else self.player1.push_bet; fn(True) if not cbj else fn(); self.player1.round_message=msg
-        elif cbj: self.player1.is_done=True;self.player1.lose_bet();self.player1.round_message="Pierde(Crupier BJ)"
-        if self.player2:
-            if p2bj: self.player2.is_done=True; msg,fn="¡BJ!" if not cbj else "Empate BJ",self.player2.win_bet if not cbj else self.player2.push_bet; fn(True) if not cbj else fn(); self.player2.round_message=msg
-            elif cbj: self.player2.is_done=True;self.player2.lose_bet();self.player2.round_message="Pierde(Crupier BJ)"
-        next_phase_determined = False
-        if self.player1.is_done and (not self.player2 or self.player2.is_done):
-            if cbj or self.all_human_players_bust_or_bj(): self.game_phase="ROUND_OVER"; await self.finalize_round_results(); next_phase_determined=True
-            else: self.game_phase="CRUPIER_TURN"; await self.play_crupier_turn(); next_phase_determined=True
-        elif not self.player1.is_done: self.game_phase="PLAYER1_TURN"; next_phase_determined=True
-        elif self.player2 and not self.player2.is_done: self.game_phase="PLAYER2_TURN"; next_phase_determined=True
-        if next_phase_determined: await self.broadcast_game_state()
-
-    def all_human_players_bust_or_bj(self):
-        # ... (sin cambios) ...
-        p1r=self.player1.is_bust or self.player1.has_blackjack
-        return p1r and (self.player2.is_bust or self.player2.has_blackjack) if self.player2 else p1r
+        [p.add_card(self.deck.deal()) for _ in range(2) for p in self.active_seats()+[self.crupier]]
+        cbj=self.crupier.has_blackjack
+        for p_obj in self.active_seats():
+            if p_obj.has_blackjack: p_obj.is_done=True; msg,fn="¡BJ!" if not cbj else "Empate BJ",p_obj.win_bet if not cbj else p_obj.push_bet; fn(True) if not cbj else fn(); p_obj.round_message=msg
+            elif cbj: p_obj.is_done=True;p_obj.lose_bet();p_obj.round_message="Pierde(Crupier BJ)"
+        self.game_phase=self.next_turn_phase()
+        if self.game_phase=="CRUPIER_TURN":# todos terminaron en el reparto
+            if cbj or self.all_human_players_bust_or_bj(): self.game_phase="ROUND_OVER"; await self.finalize_round_results()
+            else: await self.play_crupier_turn()
+        await self.broadcast_game_state()
+
+    def all_human_players_bust_or_bj(self): return all(p_obj.is_bust or p_obj.has_blackjack for p_obj in self.active_seats())
 
-    async def handle_player_action(self, p_obj, action):
-        #Cuando un jugador dice "HIT" (pedir) o "STAND" (plantarse).
+    async def handle_player_action(self, p_obj, action, timed_out=False):
+        #Cuando un jugador dice "HIT" (pedir) o "STAND" (plantarse). timed_out: STAND automatico del reloj
         exp_ph=f"{p_obj.id_in_game.upper()}_TURN"
         if self.game_phase!=exp_ph or p_obj.is_done: await self.send_error_to_player(p_obj,"No es tu turno/terminaste."); return
         if action=="HIT":
@@ -136,29 +343,28 @@ class BlackjackGamePython:# partida del blackjack
             if p_obj.is_bust: p_obj.round_message=f"Pasó({p_obj.get_hand_value()}).Pierde.";p_obj.lose_bet()
             elif p_obj.get_hand_value()==21: p_obj.round_message="21.Planta."
             if p_obj.is_bust or p_obj.get_hand_value()==21: p_obj.is_done=True
-        elif action=="STAND": p_obj.is_done=True;p_obj.round_message=f"Plantó({p_obj.get_hand_value()})."
+        elif action=="STAND": p_obj.is_done=True;p_obj.round_message=f"{'Tiempo agotado. ' if timed_out else ''}Plantó({p_obj.get_hand_value()})."
         await self.broadcast_game_state()
         if p_obj.is_done:
-            if self.game_phase=="PLAYER1_TURN": self.game_phase="PLAYER2_TURN" if self.player2 and not self.player2.is_done else "CRUPIER_TURN"
-            elif self.game_phase=="PLAYER2_TURN": self.game_phase="CRUPIER_TURN"
+            self.game_phase=self.next_turn_phase() # los asientos juegan en orden, el siguiente sin terminar
             if self.game_phase=="CRUPIER_TURN": await self.play_crupier_turn()
             elif self.game_phase != exp_ph: await self.broadcast_game_state()
 
     async def play_crupier_turn(self):# el crupier revela su carta y juega su turno
         # ... (sin cambios) ...
-        logging.info(f"J{self.game_id}: Turno Crupier.");self.crupier.is_done=False
+        HOT_LOG.info("J%s: Turno Crupier.", self.game_id);self.crupier.is_done=False
         if self.all_human_players_bust_or_bj() and not self.crupier.has_blackjack: self.crupier.round_message="Gana(todos pasaron/BJ)";self.crupier.is_done=True
         else:
-            while self.crupier.get_hand_value()<17 and not self.crupier.is_bust: self.crupier.add_card(self.deck.deal())
+            while self.crupier.get_hand_value()<DEALER_STANDS_ON and not self.crupier.is_bust: self.crupier.add_card(self.deck.deal())
             self.crupier.is_done=True; self.crupier.round_message=f"Crupier pasó({self.crupier.get_hand_value()})" if self.crupier.is_bust else f"Crupier planta({self.crupier.get_hand_value()})"
         self.game_phase="ROUND_OVER";await self.finalize_round_results();await self.broadcast_game_state()
 
     async def finalize_round_results(self):
         # compara la mano de los jugadores y determina quien gana, pierde o empata
         # ... (sin cambios) ...
-        logging.info(f"J{self.game_id}: Finalizando."); c_val,c_bust=self.crupier.get_hand_value(),self.crupier.is_bust
-        for p_obj in [self.player1, self.player2]:
-            if not p_obj or p_obj.has_blackjack or p_obj.is_bust: continue
+        HOT_LOG.info("J%s: Finalizando.", self.game_id); c_val,c_bust=self.crupier.get_hand_value(),self.crupier.is_bust
+        for p_obj in self.active_seats():
+            if p_obj.has_blackjack or p_obj.is_bust: continue
             p_val=p_obj.get_hand_value()
             if c_bust or p_val>c_val: p_obj.win_bet();p_obj.round_message=f"Gana {p_val}vs{c_val if not c_bust else'BustC'}"
             elif p_val<c_val: p_obj.lose_bet();p_obj.round_message=f"Pierde {p_val}vs{c_val}"
@@ -167,96 +373,323 @@ class BlackjackGamePython:# partida del blackjack
     async def send_error_to_player(self, player_obj, error_message):# si un jugador intenta algo que no es, le envia un error
         # ... (sin cambios, ya usaba State.OPEN) ...
         logging.warning(f"Error para {player_obj.server_player_id}: {error_message}")
-        if player_obj.websocket and player_obj.websocket.state == State.OPEN:
-            try: await player_obj.websocket.send(json.dumps({"type": "ERROR", "payload": {"message": error_message}}))
-            except websockets.exceptions.ConnectionClosed: pass
+        if player_obj.websocket and player_obj.websocket.state == State.OPEN: send_message(player_obj.websocket, "ERROR", {"message": error_message})
+
+def diff_state(old, new, path=""):# lista de operaciones JSON Patch (RFC 6902) para pasar del estado old al new
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops = [{"op": "remove", "path": f"{path}/{k}"} for k in old if k not in new]
+        for k, v in new.items():
+            if k not in old: ops.append({"op": "add", "path": f"{path}/{k}", "value": v})
+            elif old[k] != v: ops.extend(diff_state(old[k], v, f"{path}/{k}"))
+        return ops
+    if isinstance(old, list) and isinstance(new, list) and len(new) >= len(old) and new[:len(old)] == old:# cartas nuevas al final de la mano
+        return [{"op": "add", "path": f"{path}/{i}", "value": new[i]} for i in range(len(old), len(new))]
+    return [{"op": "replace", "path": path, "value": new}]
+
+class GameRegistry:# indices de mesas y asientos, para resolver una conexion en O(1) sin recorrer todas las mesas
+    def __init__(self):
+        self.games = {}       # game_id -> BlackjackGamePython
+        self.by_ws = {}       # websocket -> (juego, PlayerPython del asiento)
+        self.by_token = {}    # resumeToken -> (juego, PlayerPython del asiento)
+    def add_game(self, game):# registra una mesa nueva junto con los asientos que ya tenga ocupados
+        self.games[game.game_id] = game
+        for p_obj in game.players_in_game.values(): self.seat(game, p_obj)
+    def seat(self, game, p_obj):# indexa un asiento (al crear la mesa o cuando alguien se une)
+        if p_obj.websocket: self.by_ws[p_obj.websocket] = (game, p_obj)
+        self.by_token[p_obj.resume_token] = (game, p_obj)
+    def detach(self, p_obj):# la conexion del asiento ya no vale; el asiento sigue localizable por resumeToken
+        if p_obj.websocket and self.by_ws.get(p_obj.websocket, (None, None))[1] is p_obj: del self.by_ws[p_obj.websocket]
+    def unseat(self, p_obj):# quita un asiento de los indices (el jugador se fue)
+        self.detach(p_obj)
+        if self.by_token.get(p_obj.resume_token, (None, None))[1] is p_obj: del self.by_token[p_obj.resume_token]
+    def remove_game(self, game):# elimina la mesa y todos sus asientos de los indices
+        for p_obj in game.seats: self.unseat(p_obj) # tambien los asientos desconectados esperando RESUME_SESSION
+        if self.games.get(game.game_id) is game: del self.games[game.game_id]
+    def get(self, game_id): return self.games.get(game_id)
+    def lookup_ws(self, websocket): return self.by_ws.get(websocket, (None, None))# (juego, jugador) o (None, None)
+    def lookup_token(self, resume_token): return self.by_token.get(resume_token, (None, None))
+
+class Lobby:# mesas abiertas esperando jugadores, en una cola por (nivel de apuestas, asientos)
+    # Emparejar es O(1): se mira la primera mesa de la cola. Las mesas llenas o eliminadas se descartan al llegar al frente.
+    def __init__(self, registry): self.registry = registry; self.waiting = collections.defaultdict(collections.deque)
+    def is_open(self, game): return not game.is_full() and self.registry.get(game.game_id) is game
+    def open_table(self, game):
+        if not game.is_full(): self.waiting[(game.stake, game.num_seats)].append(game)
+    def find_table(self, stake, num_seats):# primera mesa con sitio para ese nivel y tamaño, o None
+        queue = self.waiting.get((stake, num_seats))
+        while queue:
+            if self.is_open(queue[0]): return queue[0]
+            queue.popleft()
+        return None
+    def list_tables(self, stake=None, num_seats=None, limit=TABLE_LIST_LIMIT):# mesas abiertas para que el cliente elija (LIST_TABLES)
+        tables = []
+        for (q_stake, q_seats), queue in self.waiting.items():
+            if (stake and q_stake != stake) or (num_seats and q_seats != num_seats): continue
+            for game in queue:
+                if len(tables) >= limit: return tables
+                if self.is_open(game): tables.append({"gameId": game.game_id, "stake": game.stake, "minBet": game.min_bet, "maxBet": game.max_bet, "seats": game.num_seats, "occupied": len(game.seats)})
+        return tables
+
+class TokenBucket:# limite de mensajes de una conexion: rate por segundo con rafagas de hasta burst
+    def __init__(self, rate=CLIENT_RATE_LIMIT, burst=CLIENT_RATE_BURST):
+        self.rate = rate; self.burst = burst; self.tokens = burst; self.updated = time.monotonic(); self.rejected = 0 # rechazos seguidos
+    def allow(self):
+        if not self.rate: return True
+        now = time.monotonic(); self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate); self.updated = now
+        if self.tokens >= 1: self.tokens -= 1; self.rejected = 0; return True
+        self.rejected += 1; return False
 
 #servidor
 #memoria del casino 
+TIMERS = TimerWheel() # relojes de todas las mesas y gracias de reconexion, en una sola tarea
 CONNECTED_CLIENTS = {} # define los clientes conectados al servidor y sus objetos PlayerPython 
-ACTIVE_GAMES = {}    #mesas blackjack activas
-PENDING_GAME = None  # por si un jugador esta sperando al otro jugador, se crea una nueva mesa
+GAME_REGISTRY = GameRegistry() # indices websocket/resumeToken/game_id -> mesa
+ACTIVE_GAMES = GAME_REGISTRY.games    #mesas blackjack activas (vista del registro, no modificar directamente)
+OUTBOXES = {} # websocket -> ClientOutbox (cola de salida de cada conexion)
+METRICS.gauge("blackjack_connected_clients", "Conexiones abiertas.", lambda: len(CONNECTED_CLIENTS))
+METRICS.gauge("blackjack_active_games", "Mesas activas en este proceso.", lambda: len(ACTIVE_GAMES))
+METRICS.gauge("blackjack_table_inbox_pending", "Comandos en espera en las bandejas de todas las mesas.", lambda: sum(g.inbox.qsize() for g in ACTIVE_GAMES.values()))
+METRICS.gauge("blackjack_timers_pending", "Temporizadores guardados en la rueda.", lambda: len(TIMERS))
+METRICS.gauge("blackjack_outbox_pending", "Mensajes encolados sin enviar en todas las conexiones.", lambda: sum(len(o.pending) for o in OUTBOXES.values()))
+DELTA_CLIENTS = set() # conexiones que negociaron GAME_STATE_DELTA (SET_PROTOCOL mode "delta")
+STATE_PROTOCOLS = ["full", "delta"] # modos de GAME_STATE anunciados en SERVER_WELCOME
+LOBBY = Lobby(GAME_REGISTRY) # mesas esperando jugadores, por nivel de apuestas y tamaño
+SHARD = None # shard.ShardContext cuando este proceso es un worker de --workers N (None = un solo proceso)
+LEDGER = None # ledger.ChipLedger con --ledger (None = sin persistencia)
+ORACLE = None # strategy_oracle.StrategyOracle de HINT_REQUEST, cargado al arrancar con load_strategy()
+
+def open_ledger(path):# carga los saldos guardados y arranca la escritura en segundo plano; llamar con el loop en marcha
+    global LEDGER
+    from ledger import ChipLedger
+    LEDGER = ChipLedger(path); LEDGER.recover(); LEDGER.start()
+def load_strategy(path=None):# tabla de EV de HIT/STAND para HINT_REQUEST (ver strategy_oracle.py)
+    global ORACLE
+    from strategy_oracle import load_oracle
+    ORACLE = load_oracle(path, DEALER_STANDS_ON)
+
+def queue_text(websocket, text, is_state=False, resync_text=None):# encola un mensaje ya codificado en la cola de salida de la conexion
+    outbox = OUTBOXES.get(websocket)
+    if outbox is None: outbox = OUTBOXES[websocket] = ClientOutbox(websocket)
+    return outbox.put(text, is_state, resync_text)
+def send_message(websocket, msg_type, payload):# codifica y encola; nunca espera a la red
+    return queue_text(websocket, json.dumps({"type": msg_type, "payload": payload}))
+def close_outbox(websocket):
+    outbox = OUTBOXES.pop(websocket, None)
+    if outbox: outbox.close()
 
 # --- Manejadores del Servidor WebSocket ---
 # Este manejador recibe mensajes de los clientes y los procesa
 # estas son las funciones principales que hacen que el servidor funcione
+def seat_payload(game, p_obj):# datos del asiento para GAME_CREATED, JOINED_GAME y RESUMED; solo se envia al dueño del asiento (lleva resumeToken)
+    payload = {"gameId": game.game_id, "playerId": p_obj.id_in_game, "serverPlayerId": p_obj.server_player_id, "resumeToken": p_obj.resume_token,
+               "stake": game.stake, "seats": game.num_seats, "chips": p_obj.chips, "resumeGrace": RESUME_GRACE_SECONDS}
+    if SHARD: payload["resumePort"] = SHARD.direct_port # para reanudar hay que volver al mismo worker
+    return payload
+
+def new_resume_token():# con --workers lleva delante el worker cuyo ledger guarda el saldo ("2.xxxx"), ver token_owner
+    token = secrets.token_urlsafe(24)
+    return f"{SHARD.index}.{token}" if SHARD else token
+def token_owner(token):# indice del worker dueño del saldo de ese token si es otro distinto de este; None si es de aqui (o sin --workers)
+    if not SHARD or not isinstance(token, str): return None
+    index, _, rest = token.partition(".")
+    if not rest or not index.isdigit() or int(index) == SHARD.index or int(index) >= SHARD.workers: return None
+    return int(index)
+
+def returning_player(token):# (resumeToken, fichas) si el ledger conoce ese token y su asiento no esta ocupado ahora mismo
+    if not LEDGER or not isinstance(token, str) or GAME_REGISTRY.lookup_token(token)[1]: return None
+    chips = LEDGER.balance(token)
+    return (token, chips) if chips is not None else None
+
+async def join_table(websocket, game, returning=None):# sienta al cliente en una mesa abierta; el aviso a los demas y el estado los manda el actor
+    p_obj = game.add_player(websocket, returning) # sin await entre LOBBY.is_open y aqui: nadie mas puede ocupar el asiento
+    GAME_REGISTRY.seat(game, p_obj); CONNECTED_CLIENTS[websocket] = p_obj # PlayerPython real del juego
+    send_message(websocket, "JOINED_GAME", seat_payload(game, p_obj))
+    if game.is_full(): logging.info(f"Juego {game.game_id} completo. Fase apuestas.")
+    if SHARD: SHARD.table_changed(game)
+    await game.submit("JOINED", on_player_joined, websocket, p_obj, None)
+
+def new_game_id(): return str(uuid.uuid4())[:8]
+async def create_table(websocket, stake, num_seats, game_id=None, returning=None):# abre una mesa nueva con el cliente en el primer asiento
+    game = BlackjackGamePython(game_id or new_game_id(), websocket, num_seats, stake, returning)#crea un nuevo ID
+    GAME_REGISTRY.add_game(game); LOBBY.open_table(game)
+    if SHARD: SHARD.table_opened(game)
+    CONNECTED_CLIENTS[websocket] = game.player1 # PlayerPython real del juego
+    send_message(websocket, "GAME_CREATED", seat_payload(game, game.player1))
+    await game.broadcast_game_state()
+
+def close_table(game, p_disc, message="Oponente abandonó."):# quita la mesa de los indices ya mismo; devuelve la corrutina que cierra el actor y avisa a los demas
+    GAME_REGISTRY.remove_game(game)
+    if SHARD: SHARD.table_closed(game)
+    for timer in game.grace_timers.values(): timer.cancel()
+    logging.info(f"Juego {game.game_id} eliminado.") # el lobby la descarta sola
+    return game.close(p_disc, message)
+
+def expire_seat(game, p_obj):# vencio la gracia de un asiento desconectado: la mesa se cierra como antes de RESUME_SESSION
+    game.grace_timers.pop(p_obj, None)
+    if p_obj.websocket is None and GAME_REGISTRY.get(game.game_id) is game:
+        logging.info(f"{p_obj.id_in_game.capitalize()} ({p_obj.server_player_id}) no volvió a {game.game_id} en {RESUME_GRACE_SECONDS}s.")
+        SESSION_EVENTS.inc("expired"); TIMEOUTS.inc("grace"); asyncio.get_running_loop().create_task(close_table(game, p_obj))
+
+async def redirect_to(websocket, table):# la mesa vive en otro worker: el cliente se reconecta a su puerto directo y pide esa mesa
+    send_message(websocket, "REDIRECT", {"gameId": table["gameId"], "port": table["port"], "stake": table["stake"], "seats": table["seats"]})
+
+# --- Manejadores por tipo de mensaje ---
+# Todos reciben (websocket, mesa, asiento, payload). Los de CONNECTION_HANDLERS corren en la tarea de la conexion y no tocan
+# el estado de una mesa ya en juego; los de TABLE_HANDLERS los ejecuta el actor de la mesa (la mesa va como primer argumento).
+async def on_set_protocol(websocket, game, p_obj, payload): # el cliente elige como recibir el estado: "full" (snapshot siempre) o "delta" (parches con seq)
+    mode = payload.get("mode")
+    if mode not in STATE_PROTOCOLS: send_message(websocket, "ERROR", {"message": f"Protocolo desconocido: {mode}."}); return
+    if mode == "delta": DELTA_CLIENTS.add(websocket)
+    else: DELTA_CLIENTS.discard(websocket)
+    send_message(websocket, "PROTOCOL_SET", {"mode": mode})
+
+async def on_join_game_request(websocket, game, p_obj, payload):
+    #Primero, revisa si este jugador ya está en alguna otra partida. Si es así, le dice "ya estás jugando".
+    stake, num_seats, wanted_gid = payload.get("stake", DEFAULT_STAKE), payload.get("seats", DEFAULT_TABLE_SEATS), payload.get("gameId")
+    owner = token_owner(payload.get("resumeToken")) # con --workers el saldo solo lo puede reclamar el worker que lo guarda
+    returning = returning_player(payload.get("resumeToken")) # con el resumeToken de una sesion anterior se recupera su saldo
+    if game:
+        logging.warning(f"Websocket {websocket.remote_address} ({p_obj.server_player_id}) ya está en el juego {game.game_id}. Ignorando JOIN_GAME_REQUEST.")
+        send_message(websocket, "ERROR", {"message": f"Ya estás en el juego {game.game_id}."}) # Informar al cliente
+    elif owner is not None: # entró por otro worker (SO_REUSEPORT o REDIRECT): se juega donde esta su saldo
+        await redirect_to(websocket, {"gameId": wanted_gid, "port": SHARD.worker_port(owner), "stake": stake, "seats": num_seats})
+    elif wanted_gid and not payload.get("fallback"): #el cliente eligió una mesa de TABLE_LIST
+        wanted = GAME_REGISTRY.get(wanted_gid); remote = await SHARD.locate_table(wanted_gid) if SHARD and not wanted else None
+        if wanted and LOBBY.is_open(wanted): await join_table(websocket, wanted, returning)
+        elif remote and not returning: await redirect_to(websocket, remote)
+        elif remote: send_message(websocket, "ERROR", {"message": f"La mesa {wanted_gid} está en otro servidor que tu saldo. Pide mesa sin elegirla."})
+        else: send_message(websocket, "ERROR", {"message": f"La mesa {wanted_gid} no está disponible."})
+    elif stake not in STAKE_BUCKETS or not isinstance(num_seats, int) or not 1 <= num_seats <= MAX_TABLE_SEATS:
+        send_message(websocket, "ERROR", {"message": f"Mesa inválida: stake en {list(STAKE_BUCKETS)}, seats de 1 a {MAX_TABLE_SEATS}."})
+    else: #Si no está en otra partida, busca una mesa con sitio de ese nivel y tamaño; si no hay, abre una nueva
+        # con "fallback" (cliente que viene de un REDIRECT) se prueba primero la mesa pedida, si ya se llenó se empareja normal
+        wanted = GAME_REGISTRY.get(wanted_gid) if wanted_gid else None
+        open_game = wanted if wanted and LOBBY.is_open(wanted) else None; new_gid = new_game_id()
+        # con workers decide el broker, que ve y reserva los asientos de las mesas de todos los procesos
+        # (un jugador con saldo se queda en este worker, que es el que lo guarda)
+        table = await SHARD.match_table(stake, num_seats, new_gid, local=returning is not None) if SHARD and not open_game else None
+        if returning and GAME_REGISTRY.lookup_token(returning[0])[1]: returning = None # otro JOIN con el mismo token se sentó mientras se esperaba al broker
+        if table and table["shard"] != SHARD.index: await redirect_to(websocket, table)
+        else:
+            if table and table["gameId"] != new_gid: open_game = GAME_REGISTRY.get(table["gameId"]) # mesa de este proceso
+            elif not table and not open_game: open_game = LOBBY.find_table(stake, num_seats) # un solo proceso (o broker caido)
+            if open_game and LOBBY.is_open(open_game): await join_table(websocket, open_game, returning)
+            else: await create_table(websocket, stake, num_seats, new_gid, returning)
+
+async def on_resume_session(websocket, game, p_obj, payload):# el cliente se reconecta con el resumeToken de su asiento (nunca con el serverPlayerId, que ven los demas)
+    token = payload.get("resumeToken")
+    if game: send_message(websocket, "ERROR", {"message": f"Ya estás en el juego {game.game_id}."}); return
+    r_game, seat = GAME_REGISTRY.lookup_token(token) if isinstance(token, str) else (None, None)
+    owner = token_owner(token)
+    if owner is not None: # el asiento esta en otro worker: el cliente vuelve a intentarlo alli
+        send_message(websocket, "RESUME_FAILED", {"resumePort": SHARD.worker_port(owner), "message": "La sesión está en otro servidor."}); return
+    if not seat or r_game.closed:
+        SESSION_EVENTS.inc("resume_failed")
+        chips = LEDGER.balance(token) if LEDGER and isinstance(token, str) else None # con JOIN_GAME_REQUEST {resumeToken} se recupera este saldo
+        send_message(websocket, "RESUME_FAILED", {"chips": chips, "message": "La sesión ya no existe."}); return
+    old_ws = seat.websocket
+    if old_ws: # la conexion vieja aun no se dio por caida (p. ej. cambio de red): la nueva la reemplaza
+        GAME_REGISTRY.detach(seat); r_game.detach_player(seat); CONNECTED_CLIENTS.pop(old_ws, None)
+        asyncio.get_running_loop().create_task(old_ws.close(code=4000, reason="Sesión reanudada en otra conexión."))
+    r_game.attach_player(websocket, seat); GAME_REGISTRY.seat(r_game, seat); CONNECTED_CLIENTS[websocket] = seat
+    SESSION_EVENTS.inc("resumed"); logging.info(f"{seat.id_in_game.capitalize()} ({seat.server_player_id}) reanudó {r_game.game_id}.")
+    send_message(websocket, "RESUMED", seat_payload(r_game, seat))
+    await r_game.submit("RESUMED", on_player_resumed, websocket, seat, None)
+
+async def on_list_tables(websocket, game, p_obj, payload): # mesas abiertas (opcionalmente filtradas) para elegir una con JOIN_GAME_REQUEST {gameId}
+    tables = await SHARD.list_tables(payload.get("stake"), payload.get("seats")) if SHARD else None # con workers: mesas de todos
+    send_message(websocket, "TABLE_LIST", {"tables": tables if tables is not None else LOBBY.list_tables(payload.get("stake"), payload.get("seats")),
+                                           "stakes": {name: {"minBet": lo, "maxBet": hi} for name, (lo, hi) in STAKE_BUCKETS.items()}, "maxSeats": MAX_TABLE_SEATS})
+
+# Le pasa la información de la apuesta (quién apostó y cuánto) a la mesa para que la procese
+async def on_place_bet(game, websocket, p_obj, payload): await game.handle_bet(p_obj, payload.get("amount", 0))
+async def on_player_action(game, websocket, p_obj, payload): await game.handle_player_action(p_obj, payload.get("action")) # HIT o STAND
+async def on_resync_request(game, websocket, p_obj, payload): game.send_full_state(websocket) # el cliente detectó un hueco en los seq de los deltas
+async def on_hint_request(game, websocket, p_obj, payload):# EV de pedir y de plantarse para la mano del que pregunta, solo en su turno
+    mode = payload.get("mode", "table")
+    if game.game_phase != f"{p_obj.id_in_game.upper()}_TURN" or p_obj.is_done: await game.send_error_to_player(p_obj, "Solo puedes pedir una pista en tu turno."); return
+    if mode not in HINT_MODES: await game.send_error_to_player(p_obj, f"Modo de pista desconocido: {mode}."); return
+    up_card = game.crupier.hand[0]; total, soft = p_obj.hand_total, p_obj.is_soft()
+    if mode == "shoe": # no vistas = lo que queda en el zapato + la carta oculta del crupier (no se revela: solo cambia la composicion)
+        counts = list(game.deck.rank_counts); counts[game.crupier.hand[1].rank] += 1
+        stand, hit = ORACLE.lookup_shoe(tuple(counts), total, soft, up_card.rank)
+    else: stand, hit = ORACLE.lookup(total, soft, up_card.rank)
+    HINTS.inc(mode)
+    send_message(websocket, "HINT", {"mode": mode, "total": total, "soft": soft, "dealerUpCard": up_card.to_dict(),
+                                     "hit": round(hit, 4), "stand": round(stand, 4), "best": "HIT" if hit > stand else "STAND"})
+async def on_start_new_round_request(game, websocket, p_obj, payload):# Si la ronda anterior ya terminó, inicia una nueva
+    if game.game_phase == "ROUND_OVER": await game.start_new_round()
+    else: await game.send_error_to_player(p_obj, "No se puede iniciar nueva ronda aún.")
+async def on_player_disconnected(game, websocket, p_obj, payload):# comando interno: avisa que el asiento espera a que su jugador vuelva
+    for other in game.seats:
+        if other is not p_obj and other.websocket: send_message(other.websocket, "OPPONENT_DISCONNECTED", {"opponentName": p_obj.name, "opponentId": p_obj.server_player_id, "graceSeconds": RESUME_GRACE_SECONDS})
+async def on_player_resumed(game, websocket, p_obj, payload):# comando interno de RESUME_SESSION: los demas se enteran y el que vuelve recibe el estado completo
+    for other in game.seats:
+        if other is not p_obj and other.websocket: send_message(other.websocket, "OPPONENT_RECONNECTED", {"opponentName": p_obj.name, "opponentId": p_obj.server_player_id})
+    await game.broadcast_game_state()
+async def on_phase_timeout(game, websocket, p_obj, payload):# comando interno del reloj: la fase actual supero su plazo
+    if game.closed: return
+    if game.deadline is None or time.monotonic() < game.deadline: game.arm_clock(); return # hubo actividad mientras esperaba en la bandeja
+    phase = game.game_phase
+    if phase != game.deadline_phase: return # la fase cambio fuera del actor (join_table llena la mesa): su plazo lo pone el siguiente estado
+    if phase == "BETTING":
+        late = [p for p in game.seats if not game.bets_placed.get(p.id_in_game)]
+        TIMEOUTS.inc("betting", amount=len(late))
+        if len(late) == len(game.seats): # nadie apostó: la mesa esta abandonada
+            TABLES_EVICTED.inc("no_bets"); await close_table(game, None, "Mesa cerrada: nadie apostó."); return
+        for p in late: p.sit_out(); game.bets_placed[p.id_in_game] = True
+        logging.info(f"J{game.game_id}: {len(late)} asiento(s) sin apostar a tiempo, fuera de la ronda.")
+        await game.deal_initial_cards()
+    elif phase == "ROUND_OVER" or phase.startswith("WAITING"):
+        TABLES_EVICTED.inc("idle"); await close_table(game, None, "Mesa cerrada por inactividad.")
+    elif phase.endswith("_TURN") and phase != "CRUPIER_TURN":
+        p = next((p for p in game.seats if f"{p.id_in_game.upper()}_TURN" == phase), None)
+        if p: TIMEOUTS.inc("turn"); logging.info(f"J{game.game_id}: {p.name} sin jugar a tiempo, se planta."); await game.handle_player_action(p, "STAND", timed_out=True)
+
+async def on_player_joined(game, websocket, p_obj, payload):# comando interno de join_table: avisa a los demas asientos y manda el estado
+    for other in game.seats:
+        if other is not p_obj and other.websocket: send_message(other.websocket, "OPPONENT_JOINED", {"opponentName": p_obj.name, "opponentId": p_obj.server_player_id})
+    await game.broadcast_game_state()
+
+CONNECTION_HANDLERS = {"SET_PROTOCOL": on_set_protocol, "JOIN_GAME_REQUEST": on_join_game_request, "RESUME_SESSION": on_resume_session, "LIST_TABLES": on_list_tables}
+TABLE_HANDLERS = {"PLACE_BET": on_place_bet, "PLAYER_ACTION": on_player_action, "RESYNC_REQUEST": on_resync_request, "START_NEW_ROUND_REQUEST": on_start_new_round_request,
+                  "HINT_REQUEST": on_hint_request}
+# los tipos de mensaje fuera de estas tablas cuentan como "other" en las metricas, asi un cliente no puede crear series sin limite
+METRIC_MESSAGE_TYPES = frozenset(CONNECTION_HANDLERS) | frozenset(TABLE_HANDLERS)
+
 async def handle_client_message(websocket, message_str):
-    global PENDING_GAME
+    # cada mensaje de un cliente pasa por aqui: se busca su manejador en las tablas de arriba
     client_global_player_obj = CONNECTED_CLIENTS.get(websocket) 
-    # cada vez que un nuevo jugador se conecta, se activa esta fincion 
+    started = time.perf_counter(); msg_type = None
     try:
         message = json.loads(message_str) #El mensaje viene como texto (message_str), así que primero lo convierte de JSON a un formato que Python pueda entender
         msg_type, payload = message.get("type"), message.get("payload", {})# entiende el tipo de mensaje y su contenido
         player_log_id = client_global_player_obj.server_player_id if client_global_player_obj else '??'
         
-        game_id_from_client, game = payload.get("gameId"), None #el juego y el cliente tienen un ID de juego
-        if game_id_from_client: 
-            game = ACTIVE_GAMES.get(game_id_from_client) # se meten los jugadores a la mesa
-        
-        player_in_game_obj = None
-        if game:
-            if game.player1 and game.player1.websocket == websocket:
-                player_in_game_obj = game.player1
-                player_log_id = game.player1.server_player_id # Usar el ID del jugador del juego para logs
-            elif game.player2 and game.player2.websocket == websocket:
-                player_in_game_obj = game.player2
-                player_log_id = game.player2.server_player_id # Usar el ID del jugador del juego para logs
+        game_id_from_client = payload.get("gameId") # solo informativo: la mesa se resuelve por la conexion, no por lo que diga el cliente
+        game, player_in_game_obj = GAME_REGISTRY.lookup_ws(websocket) # O(1): websocket -> (mesa, asiento)
+        if player_in_game_obj: player_log_id = player_in_game_obj.server_player_id # Usar el ID del jugador del juego para logs
         
-        logging.info(f"Msg de {player_log_id}: {msg_type}, Payload: {payload}")
-
-
-        if msg_type == "JOIN_GAME_REQUEST": # si el jugador quizo esta funcion, entonces
-            #Primero, revisa si este jugador ya está en alguna otra partida. Si es así, le dice "ya estás jugando".
-            already_in_game = False
-            for existing_game_id, existing_game in ACTIVE_GAMES.items(): # Iterar sobre items para tener game_id
-                if (existing_game.player1 and existing_game.player1.websocket == websocket) or \
-                   (existing_game.player2 and existing_game.player2.websocket == websocket):
-                    logging.warning(f"Websocket {websocket.remote_address} ({player_log_id}) ya está en el juego {existing_game_id}. Ignorando JOIN_GAME_REQUEST.")
-                    await websocket.send(json.dumps({"type": "ERROR", "payload": {"message": f"Ya estás en el juego {existing_game_id}."}})) # Informar al cliente
-                    already_in_game = True
-                    break
-            
-            if not already_in_game: #Si no está en otra partida, mira si hay una PENDING_GAME (una mesa con un jugador esperando):
-                if PENDING_GAME is None:
-                    new_gid = str(uuid.uuid4())[:8]; PENDING_GAME = BlackjackGamePython(new_gid, websocket)#crea un nuevo ID
-                    ACTIVE_GAMES[new_gid] = PENDING_GAME
-                    CONNECTED_CLIENTS[websocket] = PENDING_GAME.player1 # PlayerPython real del juego
-                    await websocket.send(json.dumps({"type": "GAME_CREATED", "payload": {"gameId": new_gid, "playerId": "player1", "serverPlayerId": PENDING_GAME.player1.server_player_id}}))
-                    await PENDING_GAME.broadcast_game_state()
-                else:
-                    
-                    if PENDING_GAME.player1 and PENDING_GAME.player1.websocket == websocket:
-                        logging.warning(f"Websocket {websocket.remote_address} ({player_log_id}) intentó unirse a su propio juego pendiente como P2. Ignorando.")
-                        await websocket.send(json.dumps({"type": "ERROR", "payload": {"message": "No puedes unirte a tu propio juego como oponente."}}))
-                        # el jugador 1 intenta unirse a su propio juego pendiente como jugador 2, lo cual no tiene sentido
-                    elif PENDING_GAME.add_player2(websocket):
-                        CONNECTED_CLIENTS[websocket] = PENDING_GAME.player2 # PlayerPython real del juego
-                        await websocket.send(json.dumps({"type": "JOINED_GAME", "payload": {"gameId": PENDING_GAME.game_id, "playerId": "player2", "serverPlayerId": PENDING_GAME.player2.server_player_id}}))
-                        if PENDING_GAME.player1 and PENDING_GAME.player1.websocket:
-                             await PENDING_GAME.player1.websocket.send(json.dumps({"type": "OPPONENT_JOINED", "payload": {"opponentName": PENDING_GAME.player2.name, "opponentId": PENDING_GAME.player2.server_player_id}}))
-                        logging.info(f"Juego {PENDING_GAME.game_id} completo. Fase apuestas.")
-                        await PENDING_GAME.broadcast_game_state()
-                        PENDING_GAME = None
-                    else: await websocket.send(json.dumps({"type": "ERROR", "payload": {"message": "Juego pendiente lleno o error."}}))
-        
-        elif game and player_in_game_obj: # Solo procesar si el juego existe Y el websocket corresponde a un jugador en ese juego
-            logging.info(f"DEBUG handle_client_message: Procesando para player_in_game_obj.id_in_game: {player_in_game_obj.id_in_game}, player_in_game_obj.name: {player_in_game_obj.name}") # LOG AÑADIDO
-            if msg_type == "PLACE_BET": await game.handle_bet(player_in_game_obj, payload.get("amount",0))
-            # si es "PLACE_BET": Le pasa la información de la apuesta (quién apostó y cuánto) al objeto BlackjackGamePython correspondiente para que la procese (game.handle_bet()).
-            elif msg_type == "PLAYER_ACTION": await game.handle_player_action(player_in_game_obj, payload.get("action"))
-            #Si es "PLAYER_ACTION" (HIT o STAND): Le pasa la acción al objeto BlackjackGamePython (game.handle_player_action())
-            elif msg_type == "START_NEW_ROUND_REQUEST":
-                #Si es "START_NEW_ROUND_REQUEST": Si la ronda anterior ya terminó, le dice al BlackjackGamePython que inicie una nueva (game.start_new_round()).    
-                if game.game_phase == "ROUND_OVER": await game.start_new_round()
-                else: await game.send_error_to_player(player_in_game_obj, "No se puede iniciar nueva ronda aún.")
-        elif msg_type != "JOIN_GAME_REQUEST": # Si el mensaje no es "JOIN_GAME_REQUEST" y no hay un juego o jugador correspondiente, se ignora.
+        HOT_LOG.debug("Msg de %s: %s, Payload: %s", player_log_id, msg_type, {**payload, "resumeToken": "<oculto>"} if "resumeToken" in payload else payload) # el token es un secreto
+
+        if msg_type in CONNECTION_HANDLERS: await CONNECTION_HANDLERS[msg_type](websocket, game, player_in_game_obj or client_global_player_obj, payload)
+        elif msg_type in TABLE_HANDLERS and game and player_in_game_obj and await game.submit(msg_type, TABLE_HANDLERS[msg_type], websocket, player_in_game_obj, payload):
+            HOT_LOG.debug("handle_client_message: %s (%s) en %s", player_in_game_obj.id_in_game, player_in_game_obj.name, game.game_id)
+        else: # tipo desconocido, o mensaje de mesa sin mesa (o con la mesa ya cerrada)
             logging.warning(f"Msg {msg_type} para juego '{game_id_from_client}' no procesado (juego no encontrado o jugador no pertenece). WS: {websocket.remote_address}")
-            if websocket.state == State.OPEN:
-                try: await websocket.send(json.dumps({"type": "ERROR", "payload": {"message": "Error de juego o sesión."}}))
-                except websockets.exceptions.ConnectionClosed: pass
+            if websocket.state == State.OPEN: send_message(websocket, "ERROR", {"message": "Error de juego o sesión."})
 
-    except json.JSONDecodeError: logging.error(f"JSON Error de {websocket.remote_address}")
-    except Exception: logging.exception(f"Error manejando msg de {websocket.remote_address}")
+    except json.JSONDecodeError: logging.error(f"JSON Error de {websocket.remote_address}"); MESSAGE_ERRORS.inc("json")
+    except Exception: logging.exception(f"Error manejando msg de {websocket.remote_address}"); MESSAGE_ERRORS.inc("exception")
+    finally:
+        label = msg_type if msg_type in METRIC_MESSAGE_TYPES else "other"
+        MESSAGES_TOTAL.inc(label); MESSAGE_SECONDS.observe(time.perf_counter() - started, label)
+
+def reject_rate_limited(websocket, limiter):# mensaje por encima del limite: se descarta; el cliente recibe un solo ERROR por racha
+    RATE_LIMITED.inc()
+    if limiter.rejected == 1:
+        logging.warning(f"Cliente {websocket.remote_address} supera {limiter.rate} msg/s. Descartando mensajes.")
+        send_message(websocket, "ERROR", {"message": "Demasiados mensajes, espera un momento."})
 
 # ... (connection_handler_main y main como estaban, usando State.OPEN) ...
 # Llegada de un jugador: Cada vez que un nuevo jugador (su navegador) se conecta al servidor, esta función se activa para esa conexión específica.
@@ -265,42 +698,67 @@ async def connection_handler_main(websocket):
     CONNECTED_CLIENTS[websocket] = temp_player_obj # 1- Registrar el cliente temporal
     logging.info(f"Cliente conectado: {websocket.remote_address}, ID global temp {temp_player_obj.server_player_id}")
     if websocket.state == State.OPEN:
-        try: await websocket.send(json.dumps({"type": "SERVER_WELCOME", "payload": {"serverPlayerId": temp_player_obj.server_player_id, "message": "Conectado. Envía JOIN_GAME_REQUEST."}}))#mensaje de bienvenida, decirle que esta conectado
+        try: await websocket.send(json.dumps({"type": "SERVER_WELCOME", "payload": {"serverPlayerId": temp_player_obj.server_player_id, "message": "Conectado. Envía JOIN_GAME_REQUEST.", "protocols": STATE_PROTOCOLS}}))#mensaje de bienvenida, decirle que esta conectado
         except websockets.exceptions.ConnectionClosed: logging.warning(f"SERVER_WELCOME falló {websocket.remote_address}"); CONNECTED_CLIENTS.pop(websocket,None); return
+    limiter = TokenBucket(CLIENT_RATE_LIMIT, CLIENT_RATE_BURST)
     try:
-        async for message in websocket: await handle_client_message(websocket, message) # 2- espera recibir mensajes del cliente
+        async for message in websocket: # 2- espera recibir mensajes del cliente
+            if limiter.allow(): await handle_client_message(websocket, message)
+            else: reject_rate_limited(websocket, limiter)
     except websockets.exceptions.ConnectionClosedError as e: logging.info(f"Cliente {CONNECTED_CLIENTS.get(websocket,temp_player_obj).server_player_id} desconectado: {e.reason} ({e.code})")
     except Exception: logging.exception(f"Error con cliente {CONNECTED_CLIENTS.get(websocket,temp_player_obj).server_player_id}:")
     finally:# 3- Cuando el cliente se desconecta, se limpia el registro de clientes y juegos
-        player_to_remove = CONNECTED_CLIENTS.pop(websocket,None)
+        player_to_remove = CONNECTED_CLIENTS.pop(websocket,None); close_outbox(websocket); DELTA_CLIENTS.discard(websocket)
         if player_to_remove: logging.info(f"Cliente global {player_to_remove.server_player_id} desregistrado.")
-        game_to_cleanup,player_id_disc=None,None
-        for gid,gi in list(ACTIVE_GAMES.items()):
-            if (gi.player1 and gi.player1.websocket==websocket) or (gi.player2 and gi.player2.websocket==websocket):
-                game_to_cleanup=gi; player_id_disc="player1" if gi.player1 and gi.player1.websocket==websocket else "player2"; break
+        game_to_cleanup,p_disc=GAME_REGISTRY.lookup_ws(websocket) # O(1) en vez de recorrer ACTIVE_GAMES
+        player_id_disc=p_disc.id_in_game if p_disc else None
         if game_to_cleanup:
             logging.info(f"{player_id_disc.capitalize()} ({player_to_remove.server_player_id if player_to_remove else 'N/A'}) desconectó de {game_to_cleanup.game_id}.")
-            other_player = game_to_cleanup.player1 if player_id_disc=="player2" else game_to_cleanup.player2 # Corregido aquí
-            if other_player and other_player.websocket and other_player.websocket.state==State.OPEN:
-                try: await other_player.websocket.send(json.dumps({"type":"OPPONENT_LEFT","payload":{"message":"Oponente abandonó."}}))
-                except:pass
-            del ACTIVE_GAMES[game_to_cleanup.game_id]; logging.info(f"Juego {game_to_cleanup.game_id} eliminado.")
-            global PENDING_GAME
-            if PENDING_GAME==game_to_cleanup:PENDING_GAME=None;logging.info("Juego pendiente eliminado.")
-
-async def main(): # función que realmente pone en marcha el servidor.
-    host = "0.0.0.0"; port = 8765 #escucha conexiones de red que escucha en todas las interfaces que tenga la computadora
+            if RESUME_GRACE_SECONDS and not game_to_cleanup.closed: # el asiento espera RESUME_SESSION; la mesa sigue
+                GAME_REGISTRY.detach(p_disc); game_to_cleanup.detach_player(p_disc); SESSION_EVENTS.inc("disconnected")
+                game_to_cleanup.grace_timers[p_disc] = TIMERS.call_later(RESUME_GRACE_SECONDS, expire_seat, game_to_cleanup, p_disc)
+                await game_to_cleanup.submit("DISCONNECTED", on_player_disconnected, None, p_disc, None)
+            else: await close_table(game_to_cleanup, p_disc) # ya nadie la encuentra; los comandos encolados terminan antes del aviso
+
+async def main(host="0.0.0.0", port=8765, metrics_port=0): # función que realmente pone en marcha el servidor.
+    #escucha conexiones de red que escucha en todas las interfaces que tenga la computadora
     #8765 es donde los clientes se conectan
+    if metrics_port: await serve_metrics(metrics_port) # solo en 127.0.0.1
+    if LEDGER_PATH: open_ledger(LEDGER_PATH)
+    load_strategy(STRATEGY_TABLE_PATH)
     logging.info(f"Servidor WebSocket Blackjack en ws://{host}:{port}")
     logging.info("Para conectar desde otra máquina, usa la IP específica (ej. ws://192.168.X.Y:8765).")
-    async with websockets.serve(connection_handler_main, host, port): await asyncio.Future()
+    async with websockets.serve(connection_handler_main, host, port, max_size=MAX_MESSAGE_BYTES): await asyncio.Future()
     #Esta es la orden principal: "Inicia un servidor WebSocket en esta dirección y puerto, y cada vez que alguien se conecte, usa la función "connection_handler_main" para atenderlo".
 
 if __name__ == "__main__":
     #Este es un truco estándar de Python. Significa: "Si este archivo server.py es el que se está ejecutando
     # directamente (y no está siendo importado por otro archivo), entonces ejecuta asyncio.run(main())".
     # Esto inicia todo el proceso asíncrono del servidor.
-    try: asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Servidor WebSocket de Blackjack.")
+    parser.add_argument("--host", default="0.0.0.0"); parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=1, help="procesos worker; con más de 1 las mesas se reparten entre núcleos (ver shard.py)")
+    parser.add_argument("--broker-port", type=int, default=8764, help="puerto local del broker de mesas en modo --workers")
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"], help="DEBUG incluye cada mensaje recibido y cada estado enviado")
+    parser.add_argument("--log-sample", type=float, default=1.0, help="fracción de los logs por mensaje/ronda que se escriben (los WARNING y ERROR siempre)")
+    parser.add_argument("--rate-limit", type=float, default=CLIENT_RATE_LIMIT, help="mensajes por segundo por conexión (0 = sin límite)")
+    parser.add_argument("--rate-burst", type=int, default=CLIENT_RATE_BURST, help="ráfaga de mensajes permitida por conexión")
+    parser.add_argument("--ledger", help="archivo donde guardar apuestas y saldos (con --workers, uno por worker: RUTA.wN)")
+    parser.add_argument("--resume-grace", type=float, default=RESUME_GRACE_SECONDS, help="segundos que se guarda el asiento de un jugador desconectado (0 = cerrar la mesa)")
+    parser.add_argument("--turn-timeout", type=float, default=TURN_TIMEOUT_SECONDS, help="segundos por turno antes de plantarse solo (0 = sin límite)")
+    parser.add_argument("--bet-timeout", type=float, default=BETTING_TIMEOUT_SECONDS, help="segundos para apostar antes de quedar fuera de la ronda (0 = sin límite)")
+    parser.add_argument("--idle-timeout", type=float, default=IDLE_TABLE_SECONDS, help="segundos que una mesa esperando o con la ronda terminada sigue abierta sin actividad (0 = sin límite)")
+    parser.add_argument("--strategy-table", help="JSON de strategy_oracle.py --out con la tabla de EV de HINT_REQUEST (sin él se calcula al arrancar)")
+    parser.add_argument("--metrics-port", type=int, default=0, help="puerto local de /metrics (formato Prometheus); con --workers, un puerto por worker a partir de este. 0 = desactivado")
+    args = parser.parse_args()
+    setup_logging(args.log_level, args.log_sample)
+    settings = {"CLIENT_RATE_LIMIT": args.rate_limit, "CLIENT_RATE_BURST": args.rate_burst, "RESUME_GRACE_SECONDS": args.resume_grace, "LEDGER_PATH": args.ledger,
+                "TURN_TIMEOUT_SECONDS": args.turn_timeout, "BETTING_TIMEOUT_SECONDS": args.bet_timeout, "IDLE_TABLE_SECONDS": args.idle_timeout,
+                "STRATEGY_TABLE_PATH": args.strategy_table} # globales del modulo que cambian los flags
+    globals().update(settings)
+    try:
+        if args.workers > 1:
+            import shard
+            shard.run_sharded(args.host, args.port, args.workers, args.broker_port, args.log_level, args.log_sample, args.metrics_port, settings)
+        else: asyncio.run(main(args.host, args.port, args.metrics_port))
     except KeyboardInterrupt: logging.info("Servidor detenido.")
-    
-
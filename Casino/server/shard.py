@@ -0,0 +1,144 @@
+# shard.py: modo multi-proceso del servidor (python server.py --workers N)
+# Cada worker es un proceso con su propio loop y sus propias mesas (las mesas quedan fijas en el worker que las creó).
+# Todos escuchan en el puerto publico con SO_REUSEPORT y ademas cada uno en su puerto directo (puerto + 1 + indice).
+# Un broker local (el proceso principal) guarda el directorio de mesas abiertas de todos los workers: si el cliente entró
+# por un worker y su mesa está en otro, recibe REDIRECT con el puerto directo del worker dueño de la mesa.
+
+import asyncio
+import collections
+import json
+import logging
+import multiprocessing
+import signal
+import socket
+import sys
+import time
+
+import websockets
+
+BROKER_HOST = "127.0.0.1"
+BROKER_TIMEOUT = 2.0 # segundos maximos esperando al broker; si no responde se juega solo con las mesas locales
+RESERVATION_SECONDS = 3 * BROKER_TIMEOUT # un asiento reservado por op_match se libera si el cliente redirigido no llega antes
+
+class ShardBroker:# directorio de mesas de todos los workers; protocolo: una linea JSON por mensaje sobre TCP local
+    def __init__(self):
+        self.tables = {} # game_id -> {"shard", "port", "stake", "seats", "occupied"}; occupied = asientos que el worker dice tener
+        self.reservations = {} # game_id -> instantes (monotonic) de los asientos dados por op_match a clientes redirigidos que aun no llegan
+        self.waiting = collections.defaultdict(collections.deque) # (stake, seats) -> game_ids con sitio, como Lobby
+    def reserved(self, gid):# reservas vigentes; las vencidas (el cliente nunca llego al worker) se liberan aqui
+        stamps = self.reservations.get(gid)
+        if not stamps: return 0
+        expired = time.monotonic() - RESERVATION_SECONDS
+        while stamps and stamps[0] < expired: stamps.popleft()
+        if not stamps: del self.reservations[gid]
+        return len(stamps)
+    def taken(self, gid): return self.tables[gid]["occupied"] + self.reserved(gid)
+    def is_open(self, gid): return gid in self.tables and self.taken(gid) < self.tables[gid]["seats"]
+    def view(self, gid): return {"gameId": gid, **self.tables[gid], "occupied": self.taken(gid)}
+    def op_open(self, gid, shard, port, stake, seats, occupied):
+        if gid in self.tables: self.op_update(gid, occupied); return # ya registrada por op_match
+        self.tables[gid] = {"shard": shard, "port": port, "stake": stake, "seats": seats, "occupied": occupied}
+        if occupied < seats: self.waiting[(stake, seats)].append(gid)
+    def op_update(self, gid, occupied):# cuenta real del worker; cada asiento nuevo consume la reserva mas antigua (ese cliente ya llego)
+        t = self.tables.get(gid)
+        if t is None: return
+        stamps = self.reservations.get(gid)
+        for _ in range(min(max(0, occupied - t["occupied"]), len(stamps) if stamps else 0)): stamps.popleft()
+        if stamps is not None and not stamps: del self.reservations[gid]
+        t["occupied"] = occupied
+    def op_close(self, gid): self.tables.pop(gid, None); self.reservations.pop(gid, None) # la cola la descarta al llegar al frente
+    def op_match(self, stake, seats, shard, new_gid, port, local=False):# primera mesa con sitio de cualquier worker (con local, solo del que pregunta), reservando el asiento
+        # si no hay ninguna, new_gid queda registrada como mesa del que pregunta en el mismo paso: dos workers
+        # emparejando a la vez no abren cada uno su propia mesa a medio llenar
+        queue = self.waiting[(stake, seats)]
+        while queue and (queue[0] not in self.tables or self.tables[queue[0]]["occupied"] >= seats): queue.popleft() # cerradas o llenas de verdad
+        for gid in queue: # las llenas solo por reservas siguen en la cola: vuelven a tener sitio si la reserva vence
+            if (not local or self.tables[gid]["shard"] == shard) and self.is_open(gid):
+                self.reservations.setdefault(gid, collections.deque()).append(time.monotonic())
+                return self.view(gid)
+        self.op_open(new_gid, shard, port, stake, seats, 1)
+        return self.view(new_gid)
+    def op_locate(self, gid): return self.view(gid) if gid in self.tables else None
+    def op_list(self, stake=None, seats=None, limit=50):
+        return [{"gameId": gid, "stake": t["stake"], "seats": t["seats"], "occupied": self.taken(gid), "shard": t["shard"]}
+                for gid, t in list(self.tables.items()) if self.is_open(gid) and (not stake or t["stake"] == stake) and (not seats or t["seats"] == seats)][:limit]
+    async def handle_worker(self, reader, writer):
+        try:
+            while line := await reader.readline():
+                msg = json.loads(line); req_id = msg.pop("id", None)
+                result = getattr(self, f"op_{msg.pop('op')}")(**msg)
+                if req_id is not None: writer.write(json.dumps({"id": req_id, "result": result}).encode() + b"\n")
+        except Exception: logging.exception("Broker: error con un worker")
+        finally: writer.close()
+    async def serve(self, port):
+        server = await asyncio.start_server(self.handle_worker, BROKER_HOST, port)
+        logging.info(f"Broker de mesas en {BROKER_HOST}:{port}")
+        async with server: await server.serve_forever()
+
+class ShardContext:# lado worker: avisa al broker de sus mesas y le pregunta por mesas de otros workers
+    def __init__(self, index, direct_port, workers=1):
+        self.index = index; self.direct_port = direct_port; self.workers = workers
+        self.writer = None; self.pending = {}; self.next_id = 0
+    async def connect(self, broker_port):
+        for _ in range(50): # el broker puede tardar un poco en arrancar
+            try: reader, self.writer = await asyncio.open_connection(BROKER_HOST, broker_port); break
+            except OSError: await asyncio.sleep(0.1)
+        else: raise ConnectionError(f"Worker {self.index}: broker no disponible en {broker_port}")
+        asyncio.get_running_loop().create_task(self.read_replies(reader))
+    async def read_replies(self, reader):
+        while line := await reader.readline():
+            msg = json.loads(line); fut = self.pending.pop(msg["id"], None)
+            if fut and not fut.done(): fut.set_result(msg["result"])
+        logging.error(f"Worker {self.index}: conexión con el broker cerrada.")
+    def notify(self, op, **kwargs):# sin respuesta, no bloquea
+        if self.writer and not self.writer.is_closing(): self.writer.write(json.dumps({"op": op, **kwargs}).encode() + b"\n")
+    async def request(self, op, **kwargs):# con respuesta; None si el broker no contesta a tiempo
+        if not self.writer or self.writer.is_closing(): return None
+        self.next_id += 1; req_id = self.next_id; fut = self.pending[req_id] = asyncio.get_running_loop().create_future()
+        self.writer.write(json.dumps({"op": op, "id": req_id, **kwargs}).encode() + b"\n")
+        try: return await asyncio.wait_for(fut, BROKER_TIMEOUT)
+        except asyncio.TimeoutError: self.pending.pop(req_id, None); logging.warning(f"Worker {self.index}: broker sin respuesta a {op}."); return None
+    # --- ganchos llamados desde server.py ---
+    def worker_port(self, index): return self.direct_port - self.index + index # puerto directo de otro worker
+    def table_opened(self, game): self.notify("open", gid=game.game_id, shard=self.index, port=self.direct_port, stake=game.stake, seats=game.num_seats, occupied=len(game.seats))
+    def table_changed(self, game): self.notify("update", gid=game.game_id, occupied=len(game.seats))
+    def table_closed(self, game): self.notify("close", gid=game.game_id)
+    async def match_table(self, stake, num_seats, new_gid, local=False):# mesa elegida por el broker (de cualquier worker, o new_gid si hay que abrirla aqui); None sin broker
+        return await self.request("match", stake=stake, seats=num_seats, shard=self.index, new_gid=new_gid, port=self.direct_port, local=local)
+    async def locate_table(self, gid):
+        table = await self.request("locate", gid=gid)
+        return table if table and table["shard"] != self.index else None
+    async def list_tables(self, stake=None, num_seats=None): return await self.request("list", stake=stake, seats=num_seats)
+
+async def serve_worker(index, host, port, broker_port, reuse_port, metrics_port=0, workers=1):
+    import server # import tardio: server.py importa este modulo solo con --workers
+    direct_port = port + 1 + index
+    server.SHARD = ShardContext(index, direct_port, workers); await server.SHARD.connect(broker_port)
+    if metrics_port: await server.serve_metrics(metrics_port + index) # cada worker tiene sus propias metricas
+    if server.LEDGER_PATH: server.open_ledger(f"{server.LEDGER_PATH}.w{index}") # cada worker guarda los saldos de sus tokens (server.token_owner)
+    server.load_strategy(server.STRATEGY_TABLE_PATH)
+    await websockets.serve(server.connection_handler_main, host, direct_port, max_size=server.MAX_MESSAGE_BYTES)
+    if reuse_port or index == 0: await websockets.serve(server.connection_handler_main, host, port, reuse_port=reuse_port, max_size=server.MAX_MESSAGE_BYTES)
+    logging.info(f"Worker {index}: ws://{host}:{port} (compartido{'' if reuse_port or index == 0 else ' no'}) y ws://{host}:{direct_port} (directo)")
+    parent = multiprocessing.parent_process()
+    while parent is None or parent.is_alive(): await asyncio.sleep(1) # si el proceso principal muere, el worker no se queda con el puerto
+    logging.warning(f"Worker {index}: proceso principal terminado, saliendo.")
+
+def run_worker(index, host, port, broker_port, reuse_port, log_level="INFO", log_sample=1.0, metrics_port=0, settings=None, workers=1):# punto de entrada de cada proceso worker
+    import server
+    for name, value in (settings or {}).items(): setattr(server, name, value) # mismos flags que el proceso principal (spawn reimporta server)
+    server.setup_logging(log_level, log_sample, f'%(asctime)s %(levelname)s [w{index} %(filename)s:%(lineno)d]: %(message)s')
+    try: asyncio.run(serve_worker(index, host, port, broker_port, reuse_port, metrics_port, workers))
+    except KeyboardInterrupt: pass
+
+def run_sharded(host, port, workers, broker_port, log_level="INFO", log_sample=1.0, metrics_port=0, settings=None):# proceso principal: arranca los workers y hace de broker
+    reuse_port = hasattr(socket, "SO_REUSEPORT")
+    if not reuse_port: logging.warning("SO_REUSEPORT no disponible: solo el worker 0 escucha en el puerto compartido, el resto por REDIRECT.")
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=run_worker, args=(i, host, port, broker_port, reuse_port, log_level, log_sample, metrics_port, settings, workers), daemon=True) for i in range(workers)]
+    for p in procs: p.start()
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0)) # con SIGTERM tambien se paran los workers (bloque finally)
+    try: asyncio.run(ShardBroker().serve(broker_port))
+    finally:
+        for p in procs: p.terminate()
+        for p in procs: p.join()
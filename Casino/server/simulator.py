@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# simulator.py: simulador Monte Carlo sin websockets de las reglas de la mesa de server.py
+# Reparte y puntua miles de rondas a la vez con NumPy (una fila por ronda) y reparte los lotes en varios procesos.
+# Sirve para medir la ventaja de la casa, la varianza y la probabilidad de ruina antes de cambiar reglas de la mesa.
+# Ejemplo: python simulator.py --rounds 2000000 --decks 1 6 --bj-payout 1.5 1.2 --strategy basic mimic_dealer --workers 4 --seed 7
+
+import argparse
+import importlib
+import itertools
+import json
+import logging
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from server import CARDS, SHOE_DECKS, DEALER_STANDS_ON, BLACKJACK_PAYOUT
+
+CARD_POINTS = np.array([c.points for c in CARDS], dtype=np.int8) # mismos puntos que Card (As = 11)
+MAX_CARDS_PER_ROUND = 26 # una mano de un jugador y el crupier nunca usan mas cartas que esto
+
+# --- Estrategias del jugador ---
+# Cada estrategia recibe arrays (total, blanda, carta visible del crupier) y devuelve un array bool: True = HIT.
+def strategy_mimic_dealer(total, soft, up): return total < DEALER_STANDS_ON # juega igual que el crupier
+def strategy_never_bust(total, soft, up): return (total < 12) | (soft & (total < 18)) # solo pide si no puede pasarse
+def strategy_basic(total, soft, up):# estrategia basica reducida a HIT/STAND (la mesa no tiene doblar ni dividir)
+    hard_hit = (total <= 11) | ((total == 12) & ((up < 4) | (up > 6))) | ((total >= 13) & (total <= 16) & (up >= 7))
+    soft_hit = (total <= 17) | ((total == 18) & (up >= 9))
+    return np.where(soft, soft_hit, hard_hit)
+STRATEGIES = {"basic": strategy_basic, "mimic_dealer": strategy_mimic_dealer, "never_bust": strategy_never_bust}
+
+def resolve_strategy(name):# nombre registrado o "modulo:funcion" para estrategias propias
+    if name in STRATEGIES: return STRATEGIES[name]
+    if ":" not in name: raise ValueError(f"Estrategia desconocida: {name}. Opciones: {', '.join(STRATEGIES)} o modulo:funcion")
+    module_name, func_name = name.split(":", 1)
+    return getattr(importlib.import_module(module_name), func_name)
+
+# --- Motor vectorizado ---
+def add_card(total, soft, points):# igual que PlayerPython.add_card, pero sobre arrays: suma y baja Ases de 11 a 1 si se pasa
+    total += points; soft += (points == 11)
+    for _ in range(2): # con una carta nueva bastan dos ajustes (21 blando + As)
+        over = (total > 21) & (soft > 0); total -= 10 * over; soft -= over
+
+def play_rounds(rng, n, num_decks, bj_payout, dealer_stands_on, strategy, bet):# simula n rondas de un jugador contra el crupier; devuelve (ganancia, blackjack del jugador) por ronda
+    shoe = np.tile(np.arange(len(CARDS), dtype=np.int8), num_decks)
+    drawn = rng.permuted(np.broadcast_to(shoe, (n, shoe.size)), axis=1)[:, :MAX_CARDS_PER_ROUND] # un zapato recien barajado por ronda
+    points = CARD_POINTS[drawn].astype(np.int16); rows = np.arange(n)
+    p_total, p_soft = np.zeros(n, np.int16), np.zeros(n, np.int16); d_total, d_soft = np.zeros(n, np.int16), np.zeros(n, np.int16)
+    for col in range(4): # mismo orden que deal_initial_cards: jugador, crupier, jugador, crupier
+        if col % 2 == 0: add_card(p_total, p_soft, points[:, col])
+        else: add_card(d_total, d_soft, points[:, col])
+    up = points[:, 1]; p_bj = p_total == 21; d_bj = d_total == 21; ptr = np.full(n, 4)
+    active = ~(p_bj | d_bj) # con blackjack de alguien la ronda termina en el reparto
+    while active.any():# turno del jugador: pide mientras la estrategia diga HIT; con 21 o pasado termina
+        hit = active & strategy(p_total, p_soft > 0, up)
+        add_card(p_total, p_soft, np.where(hit, points[rows, np.minimum(ptr, MAX_CARDS_PER_ROUND - 1)], 0)); ptr += hit
+        active = hit & (p_total < 21)
+    dealer_plays = ~(p_bj | d_bj) & (p_total <= 21) # como play_crupier_turn: si el jugador se pasó el crupier no pide
+    drawing = dealer_plays & (d_total < dealer_stands_on)
+    while drawing.any():
+        add_card(d_total, d_soft, np.where(drawing, points[rows, np.minimum(ptr, MAX_CARDS_PER_ROUND - 1)], 0)); ptr += drawing
+        drawing &= d_total < dealer_stands_on
+    profit = np.zeros(n, np.int64) # igual que win_bet/lose_bet/push_bet y finalize_round_results
+    profit[p_bj & ~d_bj] = int(bet * bj_payout)
+    profit[d_bj & ~p_bj] = -bet
+    normal = ~(p_bj | d_bj)
+    profit[normal & (p_total > 21)] = -bet
+    standing = normal & (p_total <= 21)
+    profit[standing & ((d_total > 21) | (p_total > d_total))] = bet
+    profit[standing & (d_total <= 21) & (p_total < d_total)] = -bet
+    return profit, p_bj
+
+def simulate_chunk(task):# trabajo de un proceso: un lote de rondas con su propia semilla; devuelve sumas para agregar
+    rule, seed_seq, rounds, batch, bankroll, session_rounds = task
+    rng = np.random.default_rng(seed_seq); strategy = resolve_strategy(rule["strategy"]); bet = rule["bet"]
+    batches = [play_rounds(rng, min(batch, rounds - done), rule["decks"], rule["bj_payout"], rule["dealer_stands_on"], strategy, bet)
+               for done in range(0, rounds, batch)]
+    profits = np.concatenate([b[0] for b in batches]); blackjacks = sum(int(b[1].sum()) for b in batches)
+    sessions = profits[:rounds - rounds % session_rounds].reshape(-1, session_rounds)
+    ruined = ((bankroll + np.cumsum(sessions, axis=1)) < bet).any(axis=1) # sin fichas para la siguiente apuesta
+    return {"n": int(profits.size), "sum": int(profits.sum()), "sum_sq": int((profits * profits).sum()),
+            "wins": int((profits > 0).sum()), "pushes": int((profits == 0).sum()), "losses": int((profits < 0).sum()),
+            "blackjacks": blackjacks,
+            "sessions": int(sessions.shape[0]), "ruined": int(ruined.sum())}
+
+def rule_seed(seed, rule):# semilla por regla: los resultados de una regla no cambian al añadir o quitar otras
+    key = zlib.crc32(json.dumps(rule, sort_keys=True).encode())
+    return np.random.SeedSequence(seed, spawn_key=(key,))
+
+def summarize(rule, parts):# junta los lotes de una regla (en orden fijo) y calcula EV, varianza y ruina
+    n = sum(p["n"] for p in parts); total = sum(p["sum"] for p in parts); total_sq = sum(p["sum_sq"] for p in parts)
+    mean = total / n; variance = total_sq / n - mean * mean; bet = rule["bet"]
+    sessions = sum(p["sessions"] for p in parts); ruined = sum(p["ruined"] for p in parts)
+    return {"rule": rule, "rounds": n, "ev_per_round": mean / bet, "ev_stderr": (variance / n) ** 0.5 / bet,
+            "variance_per_round": variance / (bet * bet), "stdev_per_round": variance ** 0.5 / bet,
+            "win_rate": sum(p["wins"] for p in parts) / n, "push_rate": sum(p["pushes"] for p in parts) / n,
+            "loss_rate": sum(p["losses"] for p in parts) / n, "blackjack_rate": sum(p["blackjacks"] for p in parts) / n,
+            "sessions": sessions, "ruin_probability": ruined / sessions if sessions else None}
+
+def run_simulation(rules, rounds, seed=0, workers=1, chunk_rounds=200_000, batch=20_000, bankroll=100, session_rounds=100):
+    # reparte las rondas de cada regla en lotes de tamaño fijo: el resultado no depende de cuantos procesos se usen
+    chunk_rounds = max(session_rounds, chunk_rounds - chunk_rounds % session_rounds)
+    tasks, owners = [], []
+    for i, rule in enumerate(rules):
+        sizes = [chunk_rounds] * (rounds // chunk_rounds) + ([rounds % chunk_rounds] if rounds % chunk_rounds else [])
+        for seq, size in zip(rule_seed(seed, rule).spawn(len(sizes)), sizes):
+            tasks.append((rule, seq, size, batch, bankroll, session_rounds)); owners.append(i)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool: results = list(pool.map(simulate_chunk, tasks))
+    else: results = [simulate_chunk(t) for t in tasks]
+    return [summarize(rule, [r for r, o in zip(results, owners) if o == i]) for i, rule in enumerate(rules)]
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulador Monte Carlo de las reglas de la mesa de Blackjack.")
+    parser.add_argument("--rounds", type=int, default=1_000_000, help="rondas por combinación de reglas")
+    parser.add_argument("--decks", type=int, nargs="+", default=[SHOE_DECKS])
+    parser.add_argument("--bj-payout", type=float, nargs="+", default=[BLACKJACK_PAYOUT], help="pago del blackjack (1.5 = 3:2)")
+    parser.add_argument("--dealer-stands-on", type=int, nargs="+", default=[DEALER_STANDS_ON])
+    parser.add_argument("--strategy", nargs="+", default=["basic"], help=f"{', '.join(STRATEGIES)} o modulo:funcion")
+    parser.add_argument("--bet", type=int, default=10, help="apuesta plana por ronda")
+    parser.add_argument("--bankroll", type=int, default=100, help="fichas iniciales de cada sesión (como PlayerPython)")
+    parser.add_argument("--session-rounds", type=int, default=100, help="rondas por sesión para medir la ruina")
+    parser.add_argument("--workers", type=int, default=1, help="procesos en paralelo")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", dest="json_path", help="guarda los resultados en este archivo JSON")
+    args = parser.parse_args()
+    for name in args.strategy: resolve_strategy(name) # falla pronto si la estrategia no existe
+    rules = [{"decks": d, "bj_payout": p, "dealer_stands_on": s, "strategy": st, "bet": args.bet}
+             for d, p, s, st in itertools.product(args.decks, args.bj_payout, args.dealer_stands_on, args.strategy)]
+    started = time.perf_counter()
+    results = run_simulation(rules, args.rounds, args.seed, args.workers, bankroll=args.bankroll, session_rounds=args.session_rounds)
+    elapsed = time.perf_counter() - started
+    for r in results:
+        rule = r["rule"]
+        print(f"decks={rule['decks']} bj={rule['bj_payout']} crupier<{rule['dealer_stands_on']} estrategia={rule['strategy']}: "
+              f"EV={r['ev_per_round']*100:+.3f}% ±{1.96*r['ev_stderr']*100:.3f}  var={r['variance_per_round']:.4f}  "
+              f"gana/empata/pierde={r['win_rate']:.3f}/{r['push_rate']:.3f}/{r['loss_rate']:.3f}  ruina={r['ruin_probability']}")
+    logging.info(f"{args.rounds * len(rules)} rondas en {elapsed:.1f}s")
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"seed": args.seed, "rounds": args.rounds, "bankroll": args.bankroll, "session_rounds": args.session_rounds, "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
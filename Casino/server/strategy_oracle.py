@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# strategy_oracle.py: valor esperado de HIT y STAND para la mesa de server.py (HINT_REQUEST)
+# Reglas: las de play_crupier_turn (el crupier pide con menos de DEALER_STANDS_ON, se planta con 17 blando), el jugador
+# solo puede pedir o plantarse y con 21 se planta solo. Durante el turno del jugador ya se sabe que el crupier no tiene
+# blackjack (la ronda habria terminado en el reparto), asi que la carta oculta se condiciona a no hacer blackjack.
+# EV en unidades de apuesta (1 = gana la apuesta, -1 = la pierde).
+#
+# Dos modos:
+#   - tabla: EV con un zapato recien barajado, precalculada para cada (total, blanda, carta visible). Se carga de un JSON
+#     (ver --out) o se calcula al arrancar; la consulta es un acceso a dict.
+#   - zapato: la misma cuenta con la composicion de las cartas aun no vistas (resto del zapato + carta oculta). Las
+#     probabilidades se fijan con esa composicion para toda la mano (no se descuentan las cartas que se irian sacando,
+#     la aproximacion habitual de composicion fija). Memoizado por composicion: todos los asientos de la mesa en el
+#     mismo turno comparten el calculo.
+# Ejemplo: python strategy_oracle.py --out strategy_table.json (imprime la tabla y la guarda para server.py --strategy-table)
+
+import argparse
+import functools
+import json
+import logging
+import os
+import time
+
+DEALER_STANDS_ON = 17 # como en server.py; server.py pasa el suyo a load_oracle
+RANKS = range(1, 11) # 1 = As, 10 = 10/J/Q/K
+FRESH_SHOE = (0, 4, 4, 4, 4, 4, 4, 4, 4, 4, 16) # cartas por rango en una baraja, indice = rango (0 sin usar)
+DEALER_FINALS = (17, 18, 19, 20, 21) # totales con los que se planta el crupier; el resto de la probabilidad es pasarse
+PLAYER_STATES = [(t, False) for t in range(4, 22)] + [(t, True) for t in range(12, 22)] # (total, blanda) posibles en un turno
+
+def add_card(total, soft, rank):# igual que PlayerPython.add_card con un solo As contando 11 como mucho
+    if rank == 1: total += 11; soft_aces = int(soft) + 1
+    else: total += rank; soft_aces = int(soft)
+    while total > 21 and soft_aces: total -= 10; soft_aces -= 1
+    return total, soft_aces > 0
+
+def probabilities(counts):# composicion (cuentas por rango) -> probabilidad de cada rango
+    total = sum(counts[r] for r in RANKS)
+    return tuple(counts[r] / total if r else 0.0 for r in range(11))
+
+def dealer_finals(up, probs, stands_on):# distribucion del total final del crupier dado que no tiene blackjack
+    bj_rank = 10 if up == 1 else 1 if up == 10 else None
+    hole = [0.0 if r == bj_rank else probs[r] for r in range(11)]; norm = sum(hole); hole = [p / norm for p in hole]
+    @functools.lru_cache(maxsize=None)
+    def draw(total, soft):# probabilidad de cada final (DEALER_FINALS + pasarse) desde este total
+        if total > 21: return (0.0,) * len(DEALER_FINALS) + (1.0,)
+        if total >= stands_on: return tuple(1.0 if total == f else 0.0 for f in DEALER_FINALS) + (0.0,)
+        return combine((probs[r], draw(*add_card(total, soft, r))) for r in RANKS)
+    start = add_card(0, False, up)
+    return combine((hole[r], draw(*add_card(*start, r))) for r in RANKS)
+
+def combine(weighted):
+    result = [0.0] * (len(DEALER_FINALS) + 1)
+    for weight, dist in weighted:
+        if weight:
+            for i, p in enumerate(dist): result[i] += weight * p
+    return tuple(result)
+
+def stand_ev(total, finals):# gana si el crupier se pasa o queda por debajo, empata con el mismo total
+    ev = finals[-1]
+    for dealer_total, p in zip(DEALER_FINALS, finals): ev += p if total > dealer_total else -p if total < dealer_total else 0.0
+    return ev
+
+def ev_table(up, probs, stands_on=DEALER_STANDS_ON):# {(total, blanda): (EV plantarse, EV pedir)} para una carta visible
+    finals = dealer_finals(up, probs, stands_on)
+    @functools.lru_cache(maxsize=None)
+    def best(total, soft):# EV jugando bien desde aqui; con 21 la mesa planta sola
+        stand = stand_ev(total, finals)
+        return stand if total == 21 else max(stand, hit(total, soft))
+    @functools.lru_cache(maxsize=None)
+    def hit(total, soft):
+        ev = 0.0
+        for r in RANKS:
+            new_total, new_soft = add_card(total, soft, r)
+            ev += probs[r] * (-1.0 if new_total > 21 else best(new_total, new_soft))
+        return ev
+    return {(t, s): (stand_ev(t, finals), hit(t, s)) for t, s in PLAYER_STATES}
+
+def build_table(stands_on=DEALER_STANDS_ON):# tabla precalculada: zapato recien barajado, para cada carta visible
+    probs = probabilities(FRESH_SHOE)
+    return {(t, s, up): evs for up in RANKS for (t, s), evs in ev_table(up, probs, stands_on).items()}
+
+@functools.lru_cache(maxsize=4096)
+def shoe_table(counts, up, stands_on=DEALER_STANDS_ON): return ev_table(up, probabilities(counts), stands_on)
+
+class StrategyOracle:
+    def __init__(self, table, stands_on=DEALER_STANDS_ON): self.table = table; self.stands_on = stands_on
+    def lookup(self, total, soft, up):# O(1): (EV plantarse, EV pedir) con zapato recien barajado
+        return self.table[(total, soft, up)]
+    def lookup_shoe(self, counts, total, soft, up):# con la composicion de las cartas no vistas (tupla de cuentas por rango)
+        return shoe_table(counts, up, self.stands_on)[(total, soft)]
+    def to_json(self): return {"dealerStandsOn": self.stands_on, "entries": [[t, s, up, st, h] for (t, s, up), (st, h) in sorted(self.table.items())]}
+    @classmethod
+    def from_json(cls, data): return cls({(t, s, up): (st, h) for t, s, up, st, h in data["entries"]}, data["dealerStandsOn"])
+
+def load_oracle(path=None, stands_on=DEALER_STANDS_ON):# tabla del archivo si existe y es de estas reglas; si no, se calcula
+    if path and os.path.exists(path):
+        with open(path) as f: data = json.load(f)
+        if data.get("dealerStandsOn") == stands_on: return StrategyOracle.from_json(data)
+        logging.warning(f"Oracle: {path} es de otras reglas (crupier<{data.get('dealerStandsOn')}), se recalcula.")
+    started = time.perf_counter(); oracle = StrategyOracle(build_table(stands_on), stands_on)
+    logging.info(f"Oracle: tabla de {len(oracle.table)} entradas calculada en {(time.perf_counter() - started) * 1000:.0f}ms.")
+    return oracle
+
+def main():
+    parser = argparse.ArgumentParser(description="Calcula la tabla de EV de HIT/STAND de la mesa de Blackjack.")
+    parser.add_argument("--out", help="guarda la tabla en este JSON (server.py --strategy-table)")
+    parser.add_argument("--dealer-stands-on", type=int, default=DEALER_STANDS_ON)
+    args = parser.parse_args()
+    oracle = load_oracle(stands_on=args.dealer_stands_on)
+    if args.out:
+        with open(args.out, "w") as f: json.dump(oracle.to_json(), f)
+    up_names = {1: "A", 10: "10"}
+    print("total  " + " ".join(f"{up_names.get(up, up):>5}" for up in RANKS) + "   (H = pedir, S = plantarse)")
+    for t, s in PLAYER_STATES:
+        print(f"{'B' if s else 'D'}{t:<5} " + " ".join(f"{'H' if h > st else 'S'}{max(st, h):+.2f}" for st, h in (oracle.lookup(t, s, up) for up in RANKS)))
+
+if __name__ == "__main__":
+    main()
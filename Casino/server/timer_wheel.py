@@ -0,0 +1,49 @@
+# timer_wheel.py: temporizadores de todas las mesas en una sola tarea (hashed timing wheel)
+# La rueda tiene `slots` casillas de `tick` segundos; un temporizador se guarda en la casilla de su tick de vencimiento
+# (modulo slots) y una sola tarea avanza una casilla por tick. Armar y cancelar cuesta O(1) y no crea tareas ni handles
+# del loop, asi decenas de miles de mesas con su reloj cuestan casi nada. Los plazos mas largos que una vuelta
+# se quedan en su casilla hasta la vuelta que toque. Precision: un tick.
+
+import asyncio
+import logging
+import math
+
+DEFAULT_TICK = 0.25 # segundos por casilla
+DEFAULT_SLOTS = 1024 # casillas por vuelta (256s con el tick por defecto)
+
+class WheelTimer:
+    __slots__ = ("due_tick", "callback", "args", "cancelled")
+    def __init__(self, due_tick, callback, args): self.due_tick = due_tick; self.callback = callback; self.args = args; self.cancelled = False
+    def cancel(self): self.cancelled = True # se descarta al llegar su casilla
+
+class TimerWheel:
+    def __init__(self, tick=DEFAULT_TICK, slots=DEFAULT_SLOTS):
+        self.tick = tick; self.slots = [[] for _ in range(slots)]
+        self.current = 0 # ticks avanzados desde que arranco la rueda
+        self.pending = 0 # temporizadores guardados (incluye cancelados que aun no llegaron a su casilla)
+        self.task = None
+    def __len__(self): return self.pending
+    def call_later(self, delay, callback, *args):# como loop.call_later, pero redondeado hacia arriba al siguiente tick
+        self.ensure_running()
+        timer = WheelTimer(self.current + max(1, math.ceil(delay / self.tick)), callback, args)
+        self.slots[timer.due_tick % len(self.slots)].append(timer); self.pending += 1
+        return timer
+    def ensure_running(self):# la tarea se crea con el primer temporizador (y de nuevo si cambia el loop, p. ej. en pruebas)
+        loop = asyncio.get_running_loop()
+        if self.task is None or self.task.done() or self.task.get_loop() is not loop: self.task = loop.create_task(self.run())
+    async def run(self):
+        loop = asyncio.get_running_loop(); next_time = loop.time()
+        while True:
+            next_time += self.tick; await asyncio.sleep(max(0.0, next_time - loop.time()))
+            self.advance()
+    def advance(self):# pasa a la siguiente casilla y ejecuta lo que vence en esta vuelta
+        self.current += 1; index = self.current % len(self.slots); slot = self.slots[index]
+        if not slot: return
+        due = [t for t in slot if t.due_tick <= self.current]
+        if len(due) < len(slot): self.slots[index] = [t for t in slot if t.due_tick > self.current and not t.cancelled]
+        else: self.slots[index] = []
+        self.pending -= len(slot) - len(self.slots[index])
+        for timer in due:
+            if timer.cancelled: continue
+            try: timer.callback(*timer.args)
+            except Exception: logging.exception("TimerWheel: error en un temporizador")